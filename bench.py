@@ -0,0 +1,546 @@
+# bench.py
+# Micro-benchmarks, run on the Pi to compare before/after numbers.
+#   python3 bench.py db_writer [db_dir] [rows]
+#   python3 bench.py node_storage [rows]
+#   python3 bench.py node_decode [max_frames]
+#   python3 bench.py upload_stream [rows]     (needs moto: runs against an in-process S3 stand-in)
+#   python3 bench.py upload_concurrency [windows] [latency_ms]
+#   python3 bench.py upload_formats [rows]     (parquet needs pyarrow)
+#   python3 bench.py upload_claim [db_dir] [rows] [pending]   (default 10M rows, builds a ~1 GB file)
+#   python3 bench.py ble_gateway [nodes] [seconds]   (simulated nodes behind a fake BleakClient)
+# point db_dir at the SD card (e.g. the real database/ folder) for realistic fsync cost,
+# a throwaway bench_*.db file is created there and removed afterwards
+import os, sys, time, json, random, struct, asyncio, tempfile
+
+from db import init_db, db_connect, db_open, insert_rows, claim_window, iter_pending, ack_window, pending_windows
+from node_payload import NODE_NAME_LENGTH, payload_unpack, decode_sensor_payload_v1, decode_frames, get_layout
+
+
+def _node_payload(i: int) -> dict:
+    return {
+        "ver": 1, "est-timestamp": "2025-01-01T00:00:00-05:00", "node_name": "node0001",
+        "mlx_obj_c": 21.5, "mlx_amb_c": 20.1, "sen_temp_c": 19.8, "sen_rh": 55.2,
+        "soil_temp_c": 17.3, "wind_mph": 1.2, "par_ppfd": 812.4, "shortwave_w_m2": 455.0,
+        "pyr_temp_k": 293.1, "longwave_w_m2": 350.2, "weight_in_g": 1234.5678,
+        "_ts": 1735707600 + i, "_src": "nordic",
+    }
+
+
+def _bench_db(db_dir: str = "") -> str:
+    fd, path = tempfile.mkstemp(prefix="bench_", suffix=".db", dir=db_dir or None)
+    os.close(fd)
+    init_db(path)
+    return path
+
+def _drop_db(path: str):
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def bench_db_writer(db_dir: str = "", rows: int = 2000, batch: int = 500):
+    """Old path (connect + insert + commit per row) vs group commit with executemany."""
+    db_path = _bench_db(db_dir)
+
+    items = [(1735707600 + i, "node0001", json.dumps(_node_payload(i))) for i in range(rows)]
+
+    # per row, like the original db_writer_loop
+    t0 = time.perf_counter()
+    for ts, node_id, payload in items:
+        with db_connect(db_path) as conn:
+            conn.execute(
+                "INSERT INTO node_packets(ts, node_id, payload, uploaded) VALUES (?, ?, ?, 0)",
+                (ts, node_id, payload),
+            )
+            conn.commit()
+    per_row_s = time.perf_counter() - t0
+
+    # group commit on one long-lived connection
+    conn = db_open(db_path)
+    t0 = time.perf_counter()
+    for i in range(0, rows, batch):
+        insert_rows(conn, [], items[i:i + batch])
+    batched_s = time.perf_counter() - t0
+    conn.close()
+
+    print(f"db_writer: {rows} rows -> {db_path}")
+    print(f"  per-row commit : {per_row_s:8.3f} s  {rows / per_row_s:10.0f} rows/s")
+    print(f"  batch={batch:<6d} : {batched_s:8.3f} s  {rows / batched_s:10.0f} rows/s")
+    print(f"  speedup        : {per_row_s / batched_s:8.1f}x")
+
+    _drop_db(db_path)
+
+
+def _node_frames(n: int, node_name_len: int = NODE_NAME_LENGTH) -> list:
+    rnd = random.Random(1)
+    fmt = struct.Struct(payload_unpack(node_name_len))
+    return [
+        fmt.pack(1, i * 1000, 1735707600 + i, 0, b"node0001",
+                 *[rnd.randint(-3000, 3000) for _ in range(6)], rnd.randint(0, 200000),
+                 *[rnd.randint(-3000, 3000) for _ in range(3)], rnd.randint(0, 5000), rnd.randint(0, 999999))
+        for i in range(n)
+    ]
+
+
+def bench_node_storage(rows: int = 100000):
+    """JSON rows in node_packets vs raw frames in node_frames: callback CPU, DB size, upload decode."""
+    frames = _node_frames(rows)
+
+    # callback path: decode + timestamps + json (json mode) vs bytes copy (raw mode)
+    t0 = time.perf_counter()
+    node_rows = []
+    for f in frames:
+        payload = decode_sensor_payload_v1(f, NODE_NAME_LENGTH)
+        ts = int(time.time())
+        payload["_ts"] = ts
+        payload["_src"] = "nordic"
+        node_rows.append((ts, "node0001", json.dumps(payload)))
+    json_cb_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    frame_rows = []
+    for f in frames:
+        b = bytes(f)
+        ts_ms = time.time_ns() // 1_000_000
+        frame_rows.append((ts_ms // 1000, ts_ms, "node0001", b[0], b))
+    raw_cb_s = time.perf_counter() - t0
+
+    sizes = {}
+    for name, kw in (("json", dict(node_rows=node_rows)), ("raw", dict(node_rows=[], frame_rows=frame_rows))):
+        path = _bench_db()
+        conn = db_open(path)
+        insert_rows(conn, [], **kw)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+        conn.close()
+        sizes[name] = os.path.getsize(path)
+        _drop_db(path)
+
+    # upload side: json.loads per row vs one vectorized decode per window
+    t0 = time.perf_counter()
+    for _ts, _nid, payload in node_rows:
+        json.loads(payload)
+    json_up_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    decode_frames([r[4] for r in frame_rows], [r[1] for r in frame_rows])
+    raw_up_s = time.perf_counter() - t0
+
+    print(f"node_storage: {rows} notifications")
+    print(f"  callback  json: {json_cb_s / rows * 1e6:7.2f} us/pkt   raw: {raw_cb_s / rows * 1e6:7.2f} us/pkt")
+    print(f"  db size   json: {sizes['json'] / rows:7.1f} B/row    raw: {sizes['raw'] / rows:7.1f} B/row"
+          f"  ({sizes['json'] / sizes['raw']:.1f}x smaller)")
+    print(f"  upload    json: {json_up_s / rows * 1e6:7.2f} us/row   raw: {raw_up_s / rows * 1e6:7.2f} us/row")
+
+
+def bench_node_decode(max_frames: int = 1000000):
+    """Per-packet struct.unpack + dict vs one structured-dtype decode over all frames."""
+    layout = get_layout(1)
+    base = _node_frames(10000)
+    n = 10000
+    print(f"node_decode: v1 layout, {layout.size} B/frame")
+    while n <= max_frames:
+        frames = (base * (n // len(base) + 1))[:n]
+        ts_iso = "2025-01-01T00:00:00-05:00"
+
+        t0 = time.perf_counter()
+        for f in frames:
+            layout.decode_one(f, ts_iso)
+        per_pkt_s = time.perf_counter() - t0
+
+        buf = b"".join(frames)
+        t0 = time.perf_counter()
+        layout.decode_columns(buf)
+        batch_s = time.perf_counter() - t0
+
+        print(f"  {n:8d} frames  per-packet: {n / per_pkt_s:10.0f} f/s   batch: {n / batch_s:12.0f} f/s"
+              f"   ({per_pkt_s / batch_s:6.1f}x)")
+        n *= 10
+
+
+def _moto_uploader():
+    # uploader reads S3_BUCKET and creates its client at import, so set up the mock first
+    from moto import mock_aws
+    os.environ.setdefault("S3_BUCKET", "bench-bucket")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    mock = mock_aws()
+    mock.start()
+    import uploader
+    uploader.s3.create_bucket(Bucket=uploader.S3_BUCKET)
+    return uploader, mock
+
+
+def bench_upload_stream(rows: int = 200000):
+    """Peak Python memory of the old fetchall + gzip.compress upload vs the streaming multipart path."""
+    import gzip, sqlite3, tracemalloc
+    uploader, mock = _moto_uploader()
+
+    path = _bench_db()
+    conn = db_open(path)
+    ws = 1735707600
+    frames = _node_frames(rows)
+    insert_rows(conn, [], [], [(ws + i % 300, (ws + i % 300) * 1000, "node0001", 1, f) for i, f in enumerate(frames)])
+    conn.close()
+
+    def old_upload(c):
+        rows_ = c.execute(
+            "SELECT id, ts, ts_ms, node_id, frame FROM node_frames WHERE uploaded = 0 AND ts >= ? AND ts < ? ORDER BY ts",
+            (ws, ws + 300)).fetchall()
+        records = uploader.frame_records(rows_)
+        blob = b"".join((json.dumps(r, separators=(",", ":")) + "\n").encode("utf-8") for r in records)
+        uploader.s3.put_object(Bucket=uploader.S3_BUCKET, Key="bench/old.jsonl.gz", Body=gzip.compress(blob))
+
+    results = {}
+    for name, fn in (("fetchall", old_upload),
+                     ("streaming", lambda c: uploader.window_upload(c, "node_frames", "bench", ws, ws + 300))):
+        with sqlite3.connect(path) as c:
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            fn(c)
+            dt = time.perf_counter() - t0
+            _cur, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        results[name] = (dt, peak)
+
+    done = sqlite3.connect(path).execute("SELECT COUNT(*) FROM node_frames WHERE uploaded = 1").fetchone()[0]
+    mock.stop()
+    _drop_db(path)
+
+    print(f"upload_stream: {rows} rows in one window, part size {uploader.S3_PART_BYTES // 2**20} MiB")
+    for name, (dt, peak) in results.items():
+        print(f"  {name:10s}: {dt:7.2f} s  peak python heap {peak / 2**20:8.1f} MiB")
+    print(f"  rows marked uploaded: {done}")
+
+
+class LatencyS3:
+    """S3 stand-in that only sleeps `latency_s` per request (cellular round trip), thread-safe."""
+
+    def __init__(self, latency_s: float):
+        self.latency_s = latency_s
+        self.requests = 0
+
+    def _call(self, **resp):
+        self.requests += 1
+        time.sleep(self.latency_s)
+        return resp
+
+    def put_object(self, **kw):
+        return self._call()
+
+    def create_multipart_upload(self, **kw):
+        return self._call(UploadId="bench")
+
+    def upload_part(self, **kw):
+        return self._call(ETag=f"part{kw['PartNumber']}")
+
+    def complete_multipart_upload(self, **kw):
+        return self._call()
+
+    def abort_multipart_upload(self, **kw):
+        return self._call()
+
+
+def bench_upload_concurrency(windows: int = 48, latency_ms: float = 300.0):
+    """catch_up over a backlog (2 tables x windows) with 1..8 upload threads against an injected-latency S3."""
+    import sqlite3
+    os.environ.setdefault("S3_BUCKET", "bench-bucket")
+    import uploader
+
+    path = _bench_db()
+    conn = db_open(path)
+    period = uploader.UPLOAD_PERIOD_S
+    end = (int(time.time()) // period) * period
+    ts = [end - windows * period + i * 10 for i in range(windows * period // 10)]
+    insert_rows(conn, [(t, json.dumps({"t": t})) for t in ts],
+                [(t, "node0001", json.dumps(_node_payload(t))) for t in ts])
+    conn.close()
+
+    fake = LatencyS3(latency_ms / 1000.0)
+    uploader.s3 = fake
+    uploader.DB_PATH = path
+    uploader.CATCHUP_MAX_WPS = 0
+    uploader.CATCHUP_BUDGET_S = 1e9
+
+    print(f"upload_concurrency: {windows} windows x 2 tables, {latency_ms:.0f} ms per S3 request")
+    base = None
+    for workers in (1, 2, 4, 8):
+        with sqlite3.connect(path) as c:
+            c.execute("UPDATE sensor_samples SET uploaded = 0")
+            c.execute("UPDATE node_packets SET uploaded = 0")
+        uploader.CATCHUP_CONCURRENCY = workers
+        with sqlite3.connect(path) as c:
+            t0 = time.perf_counter()
+            rows = uploader.catch_up(c, end)
+            dt = time.perf_counter() - t0
+            left = c.execute("SELECT COUNT(*) FROM sensor_samples WHERE uploaded = 0").fetchone()[0]
+        base = base or dt
+        print(f"  workers={workers}: {dt:6.2f} s  {2 * windows / dt:6.1f} objects/s  "
+              f"rows={rows} left={left}  ({base / dt:4.1f}x)")
+    _drop_db(path)
+
+
+def _sensor_payload(i: int, rnd: random.Random, spectrum: bool) -> dict:
+    rec = {
+        "est-timestamp": "2025-01-01T00:00:00-05:00", "device_id": "pi-gateway-1",
+        "mcp3008": {"sq214_1": {"ppfd": rnd.uniform(0, 2000)}, "wind": {"wind_mph": rnd.uniform(0, 10)}},
+        "i2c": {"scd41": {"co2_ppm": rnd.randint(400, 900), "temp_c": rnd.uniform(10, 30), "rh_pct": rnd.uniform(30, 90)},
+                "lps28": {"pressure_hpa": rnd.uniform(990, 1030), "temp_c": rnd.uniform(10, 30)}},
+        "sn522": {k: rnd.uniform(-100, 900) for k in ("cal_sw_up_w", "cal_sw_down_w", "cal_lw_up_w", "cal_lw_down_w",
+                                                      "sw_net_w", "lw_net_w", "net_total_w", "albedo",
+                                                      "lw_up_temp", "lw_down_temp")},
+        "sq522": {"calibrated_output": rnd.uniform(0, 2000)},
+        "spectrometer": {},
+        "_src": "pi", "_ts": 1735707600 + i, "_ts_db": 1735707600 + i,
+    }
+    if spectrum:
+        rec["spectrometer"]["raw_y"] = [float(rnd.randint(900, 30000)) for _ in range(2048)]
+    return rec
+
+
+class _CountingSink:
+    def __init__(self):
+        self.n = 0
+
+    def write(self, b):
+        self.n += len(b)
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def tell(self):
+        return self.n
+
+    closed = False
+
+
+def bench_upload_formats(rows: int = 20000):
+    """Object size and encode throughput, gzip JSONL vs Parquet (zstd), per table kind."""
+    from upload_formats import get_format
+    rnd = random.Random(2)
+    node = decode_frames(_node_frames(rows), [1735707600000 + i * 1000 for i in range(rows)])
+    for r in node:
+        r.update(_ts=1735707600, _src="nordic", _ts_db=1735707600)
+    datasets = {
+        "node_frames": node,
+        "sensor_samples": [_sensor_payload(i, rnd, False) for i in range(rows)],
+        "sensor+spectra": [_sensor_payload(i, rnd, True) for i in range(max(1, rows // 20))],
+    }
+
+    print(f"upload_formats: chunks of 2000 records")
+    for name, records in datasets.items():
+        table = "node_frames" if name == "node_frames" else "sensor_samples"
+        chunks = [records[i:i + 2000] for i in range(0, len(records), 2000)]
+        line = f"  {name:15s} {len(records):6d} rows"
+        for fmt_name in ("jsonl", "parquet"):
+            fmt = get_format(fmt_name, table)
+            sink = _CountingSink()
+            t0 = time.perf_counter()
+            fmt.write(sink, chunks)
+            dt = time.perf_counter() - t0
+            line += f" | {fmt_name}: {sink.n / len(records):8.1f} B/row {len(records) / dt:8.0f} rows/s"
+        print(line)
+
+
+def _timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, (time.perf_counter() - t0) * 1000.0
+
+def _mark_in_list(conn, table: str, ids: list, limit: int = 999):
+    # the original mark_uploaded: one placeholder per id, chunked under SQLITE_MAX_VARIABLE_NUMBER
+    for i in range(0, len(ids), limit):
+        part = ids[i:i + limit]
+        conn.execute(f"UPDATE {table} SET uploaded = 1 WHERE id IN ({','.join('?' * len(part))})", part)
+
+def bench_upload_claim(db_dir: str = "", rows: int = 10_000_000, pending: int = 86400):
+    """
+    Upload bookkeeping on a big sensor_samples table (1 row/s, last `pending` rows not uploaded):
+    full (uploaded, ts) index + IN-list marking vs partial pending index + id-range claim/ack.
+    """
+    path = _bench_db(db_dir)
+    conn = db_open(path)
+    t_start = 1735707600
+    t0 = time.perf_counter()
+    conn.execute(
+        """
+        INSERT INTO sensor_samples(ts, payload, uploaded)
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+        SELECT ? + i, printf('{"t":%d,"co2":%d,"temp_c":%.2f,"rh":%.2f}', ? + i, 400 + i % 500, 20 + (i % 97) / 10.0, 50 + (i % 37) / 3.0),
+               CASE WHEN i < ? THEN 1 ELSE 0 END
+        FROM n
+        """,
+        (rows - 1, t_start, t_start, rows - pending),
+    )
+    print(f"upload_claim: {rows} rows ({pending} pending) -> {path}, built in {time.perf_counter() - t0:.1f} s")
+    end_ts = t_start + rows
+    last_window = (end_ts // 300) * 300 - 300
+
+    variants = [
+        ("full (uploaded, ts) + IN list", "CREATE INDEX bench_idx ON sensor_samples(uploaded, ts)", True),
+        ("partial WHERE uploaded = 0   ", "CREATE INDEX bench_idx ON sensor_samples(ts) WHERE uploaded = 0", False),
+    ]
+    for name, create, in_list in variants:
+        conn.execute("DROP INDEX IF EXISTS idx_sensor_pending_ts")
+        conn.execute("DROP INDEX IF EXISTS bench_idx")
+        conn.execute(f"UPDATE sensor_samples SET uploaded = 0 WHERE id > ?", (rows - pending,))
+        conn.execute("VACUUM")
+        pages0 = conn.execute("PRAGMA page_count").fetchone()[0]
+        _, build_ms = _timed(conn.execute, create)
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        idx_mb = (conn.execute("PRAGMA page_count").fetchone()[0] - pages0) * page_size / 1e6
+
+        # steady-state inserts (500-row group commits of new pending rows)
+        batch = [(end_ts + i, '{"t":0}') for i in range(500)]
+        _, ins_ms = _timed(lambda: [insert_rows(conn, batch, []) for _ in range(20)])
+
+        wins, scan_ms = _timed(pending_windows, conn, "sensor_samples", 300, end_ts)
+
+        def cycle(ws, we):
+            # claim + read + ack one window, the way the uploader does it
+            if in_list:
+                cur = conn.execute("SELECT id, ts, payload FROM sensor_samples "
+                                   "WHERE uploaded = 0 AND ts >= ? AND ts < ? ORDER BY ts", (ws, we))
+                got = cur.fetchall()
+                conn.execute("BEGIN")
+                _mark_in_list(conn, "sensor_samples", [r[0] for r in got])
+                conn.execute("COMMIT")
+                return len(got)
+            max_id = claim_window(conn, "sensor_samples")
+            got = sum(len(c) for c in iter_pending(conn, "sensor_samples", "id, ts, payload", ws, we, max_id, 2000))
+            conn.execute("BEGIN")
+            ack_window(conn, "sensor_samples", ws, we, max_id)
+            conn.execute("COMMIT")
+            return got
+
+        n_small, small_ms = _timed(cycle, last_window, last_window + 300)
+        n_all, all_ms = _timed(cycle, 0, end_ts)
+        print(f"  {name}: index {idx_mb:7.1f} MB (built {build_ms / 1000:5.1f} s) | "
+              f"insert {20 * 500 / (ins_ms / 1000):7.0f} rows/s | pending_windows {len(wins)} in {scan_ms:7.1f} ms | "
+              f"300 s window ({n_small} rows) {small_ms:6.1f} ms | whole backlog ({n_all} rows) {all_ms:7.0f} ms")
+        conn.execute("DELETE FROM sensor_samples WHERE id > ?", (rows,))
+    conn.close()
+    _drop_db(path)
+
+
+class _FakeNode:
+    """A simulated Nordic node: samples every period whether anyone is connected or not."""
+
+    def __init__(self, address: str, period_s: float):
+        self.address = address
+        self.period_s = period_s
+        self.boot = time.monotonic()
+        self.fmt = struct.Struct(payload_unpack(NODE_NAME_LENGTH))
+
+    def frame(self, k: int) -> bytes:
+        return self.fmt.pack(1, int(k * self.period_s * 1000), 1735707600 + k, 0, self.address[-8:].encode(),
+                             *[0] * 6, 0, 0, 0, 0, 0, 0)
+
+
+class _FakeBleakClient:
+    """Stands in for bleak.BleakClient: connect latency, notifications on the node's schedule, random link drops."""
+    nodes = {}
+    connect_s = 0.02
+    drop_p = 0.01
+    rnd = random.Random(3)
+
+    def __init__(self, address, disconnected_callback=None):
+        self.node = self.nodes[address]
+        self.cb = disconnected_callback
+        self.is_connected = False
+        self._task = None
+
+    async def connect(self):
+        await asyncio.sleep(self.connect_s)
+        self.is_connected = True
+
+    async def start_notify(self, _uuid, handler):
+        async def run():
+            node = self.node
+            k = int((time.monotonic() - node.boot) / node.period_s) + 1
+            while self.is_connected:
+                await asyncio.sleep(max(0.0, node.boot + k * node.period_s - time.monotonic()))
+                if not self.is_connected:
+                    break
+                if self.rnd.random() < self.drop_p:
+                    self.is_connected = False
+                    self.cb(self)
+                    break
+                handler(0, bytearray(node.frame(k)))
+                k += 1
+        self._task = asyncio.ensure_future(run())
+
+    async def stop_notify(self, _uuid):
+        if self._task:
+            self._task.cancel()
+
+    async def disconnect(self):
+        self.is_connected = False
+        if self._task:
+            self._task.cancel()
+
+
+def bench_ble_gateway(nodes: int = 12, seconds: float = 10.0, period_s: float = 0.1):
+    """Gateway against simulated nodes: all nodes connected at once vs round robin through 4 slots."""
+    import logging
+    from ble_gateway import BleGateway
+    logging.getLogger("ble").setLevel(logging.ERROR)
+
+    async def run(n: int, slots: int):
+        _FakeBleakClient.nodes = {f"AA:00:00:00:{i:02d}": _FakeNode(f"node{i:04d}", period_s) for i in range(n)}
+        got = []
+        gw = BleGateway(
+            "notify", lambda node_id, b: got.append(node_id),
+            addresses=[(a, node.address) for a, node in _FakeBleakClient.nodes.items()],
+            max_connections=slots, dwell_s=5 * period_s, drain_packets=3, sample_period_s=period_s,
+            retry_s=period_s, client_factory=_FakeBleakClient,
+        )
+        task = asyncio.ensure_future(gw.run())
+        await asyncio.sleep(seconds)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        st = gw.stats()
+        tot = {k: sum(x[k] for x in st) for k in ("packets", "missed", "connects", "drops", "cycles", "connect_failures")}
+        loss = 100.0 * tot["missed"] / max(1, tot["packets"] + tot["missed"])
+        print(f"  {n:3d} nodes / {slots} slots: packets={tot['packets']:6d} (callbacks {len(got)}) missed={tot['missed']:6d} "
+              f"({loss:4.1f}%) connects={tot['connects']} cycles={tot['cycles']} drops={tot['drops']} "
+              f"per node {min(x['packets'] for x in st)}..{max(x['packets'] for x in st)} packets")
+
+    print(f"ble_gateway: {seconds:.0f} s, one sample per {period_s * 1000:.0f} ms per node, "
+          f"{_FakeBleakClient.drop_p * 100:.0f}% link drops per packet")
+    asyncio.run(run(min(nodes, 4), 4))
+    asyncio.run(run(nodes, 4))
+
+
+BENCHES = {
+    "db_writer": lambda args: bench_db_writer(
+        args[0] if len(args) > 0 else "",
+        int(args[1]) if len(args) > 1 else 2000,
+    ),
+    "node_storage": lambda args: bench_node_storage(int(args[0]) if args else 100000),
+    "node_decode": lambda args: bench_node_decode(int(args[0]) if args else 1000000),
+    "upload_stream": lambda args: bench_upload_stream(int(args[0]) if args else 200000),
+    "upload_concurrency": lambda args: bench_upload_concurrency(
+        int(args[0]) if len(args) > 0 else 48,
+        float(args[1]) if len(args) > 1 else 300.0,
+    ),
+    "upload_formats": lambda args: bench_upload_formats(int(args[0]) if args else 20000),
+    "upload_claim": lambda args: bench_upload_claim(
+        args[0] if len(args) > 0 else "",
+        int(args[1]) if len(args) > 1 else 10_000_000,
+        int(args[2]) if len(args) > 2 else 86400,
+    ),
+    "ble_gateway": lambda args: bench_ble_gateway(
+        int(args[0]) if len(args) > 0 else 12,
+        float(args[1]) if len(args) > 1 else 10.0,
+    ),
+}
+
+if __name__ == "__main__":
+    name = sys.argv[1] if len(sys.argv) > 1 else ""
+    if name not in BENCHES:
+        print("usage: python3 bench.py {%s} [args...]" % ",".join(BENCHES))
+        sys.exit(1)
+    BENCHES[name](sys.argv[2:])
@@ -0,0 +1,331 @@
+# ble_gateway.py
+# one asyncio loop supervising many Nordic nodes
+#   - every node runs its own reconnect state machine (one task per node)
+#   - at most max_connections links are up at once; with more nodes than that the nodes take
+#     turns: connect, drain notifications, disconnect, back of the queue (round robin)
+#   - per-node throughput and missed-sample counters (gaps in the frames' uptime_ms)
+# BleakClient / BleakScanner are injectable, so the gateway runs against fakes (see bench.py)
+import time, asyncio, logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from node_payload import frame_uptime_ms
+
+try:
+    from bleak import BleakClient, BleakScanner
+except ImportError:  # fakes can be passed in instead
+    BleakClient = None
+    BleakScanner = None
+
+LOG = logging.getLogger("ble")
+
+# node states
+IDLE = "idle"                # not started yet
+WAITING = "waiting"          # queued for a connection slot
+CONNECTING = "connecting"
+CONNECTED = "connected"      # notifications flowing
+BACKOFF = "backoff"          # connect failed / link dropped, waiting to retry
+
+
+class BleNode:
+    """State and counters for one node."""
+
+    def __init__(self, address: str, name: str = ""):
+        self.address = address
+        self.name = name
+        self.state = IDLE
+        self.connected_at: Optional[float] = None   # monotonic
+        self.last_uptime_ms: Optional[int] = None
+        self.counters = {
+            "connects": 0,
+            "connect_failures": 0,
+            "drops": 0,              # link lost while we wanted it up
+            "cycles": 0,             # planned disconnects (round robin)
+            "packets": 0,
+            "bytes": 0,
+            "missed": 0,             # samples the node took that never arrived
+            "reboots": 0,            # uptime_ms went backwards
+            "connected_s": 0.0,
+            "last_rx": 0.0,          # epoch seconds
+        }
+
+    @property
+    def node_id(self) -> str:
+        return self.name or self.address
+
+    def on_frame(self, data: bytes, period_ms: int):
+        c = self.counters
+        c["packets"] += 1
+        c["bytes"] += len(data)
+        c["last_rx"] = time.time()
+
+        up = frame_uptime_ms(data)
+        if up is None or period_ms <= 0:
+            return
+        last, self.last_uptime_ms = self.last_uptime_ms, up
+        if last is None:
+            return
+        if up < last:
+            c["reboots"] += 1
+        else:
+            c["missed"] += max(0, round((up - last) / period_ms) - 1)
+
+    def set_connected(self, up: bool):
+        now = time.monotonic()
+        if self.connected_at is not None:
+            self.counters["connected_s"] += now - self.connected_at
+        self.connected_at = now if up else None
+
+    def stats(self) -> Dict[str, Any]:
+        c = dict(self.counters)
+        if self.connected_at is not None:
+            c["connected_s"] += time.monotonic() - self.connected_at
+        expected = c["packets"] + c["missed"]
+        return dict(
+            c,
+            node=self.node_id,
+            address=self.address,
+            state=self.state,
+            loss_pct=100.0 * c["missed"] / expected if expected else 0.0,
+            packets_per_min=60.0 * c["packets"] / c["connected_s"] if c["connected_s"] else 0.0,
+            bytes_per_s=c["bytes"] / c["connected_s"] if c["connected_s"] else 0.0,
+        )
+
+
+class _Slots:
+    """Connection slots handed out strictly first come, first served (asyncio.Semaphore may let a releaser barge back in)."""
+
+    def __init__(self, n: int):
+        self.free = n
+        self._waiters: "deque[asyncio.Future]" = deque()
+
+    async def acquire(self):
+        if self.free > 0 and not self._waiters:
+            self.free -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()     # got the slot just as we were cancelled: pass it on
+            else:
+                self._waiters.remove(fut)
+            raise
+
+    def release(self):
+        # hand the slot straight to the next waiter
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.free += 1
+
+
+async def _wait_any(events: Iterable[asyncio.Event], timeout: float):
+    tasks = [asyncio.ensure_future(e.wait()) for e in events]
+    try:
+        await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for t in tasks:
+            t.cancel()
+
+
+class BleGateway:
+    """
+    Connection manager for N nodes.
+      on_frame(node_id, frame_bytes) is called from the notification callback (keep it cheap).
+      on_connect(client) runs once per connection before notifications start (time sync).
+    Nodes come from `addresses` [(address, name), ...] and/or periodic scans matched by name_filter(name).
+    """
+
+    def __init__(
+        self,
+        notify_uuid: str,
+        on_frame: Callable[[str, bytes], None],
+        addresses: Iterable[Tuple[str, str]] = (),
+        name_filter: Optional[Callable[[str], bool]] = None,
+        max_connections: int = 4,
+        dwell_s: float = 60.0,
+        drain_packets: int = 1,
+        sample_period_s: float = 30.0,
+        connect_timeout_s: float = 20.0,
+        retry_s: float = 2.0,
+        scan_period_s: float = 300.0,
+        scan_timeout_s: float = 10.0,
+        stats_period_s: float = 300.0,
+        on_connect: Optional[Callable[[Any], Awaitable[None]]] = None,
+        client_factory=None,
+        scanner=None,
+    ):
+        self.notify_uuid = notify_uuid
+        self.on_frame = on_frame
+        self.name_filter = name_filter
+        self.max_connections = max(1, int(max_connections))
+        self.dwell_s = dwell_s
+        self.drain_packets = max(1, int(drain_packets))
+        self.period_ms = int(sample_period_s * 1000)
+        self.connect_timeout_s = connect_timeout_s
+        self.retry_s = retry_s
+        self.scan_period_s = scan_period_s
+        self.scan_timeout_s = scan_timeout_s
+        self.stats_period_s = stats_period_s
+        self.on_connect = on_connect
+        self.client_factory = client_factory or BleakClient
+        self.scanner = scanner or BleakScanner
+        if self.client_factory is None:
+            raise RuntimeError("bleak is not installed (pip install bleak)")
+
+        self.nodes: Dict[str, BleNode] = {}
+        self._static = list(addresses)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._slots: Optional[_Slots] = None
+
+    @property
+    def cycling(self) -> bool:
+        """More nodes than connection slots: take turns instead of holding links open."""
+        return len(self.nodes) > self.max_connections
+
+    def add_node(self, address: str, name: str = "") -> BleNode:
+        node = self.nodes.get(address)
+        if node is None:
+            node = self.nodes[address] = BleNode(address, name)
+            self._tasks[address] = asyncio.ensure_future(self._run_node(node))
+            LOG.info("BLE node added: %s (%s), %d nodes, %d slots%s", node.node_id, address,
+                     len(self.nodes), self.max_connections, " (round robin)" if self.cycling else "")
+        return node
+
+    async def run(self):
+        self._slots = _Slots(self.max_connections)
+        for address, name in self._static:
+            self.add_node(address, name)
+        if not self.nodes and self.name_filter is None:
+            raise RuntimeError("No BLE nodes configured (set BLE_ADDRESSES, BLE_ADDRESS or a name filter)")
+
+        stats_task = asyncio.ensure_future(self._stats_loop())
+        try:
+            while True:
+                if self.name_filter is None:
+                    await asyncio.sleep(3600)
+                    continue
+                await self.scan()
+                # nothing found yet: look again soon
+                await asyncio.sleep(self.scan_period_s if self.nodes else min(30.0, self.scan_period_s))
+        finally:
+            tasks = [stats_task, *self._tasks.values()]
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def scan(self):
+        try:
+            devices = await self.scanner.discover(timeout=self.scan_timeout_s)
+        except Exception as e:
+            LOG.warning("BLE scan failed: %r", e)
+            return
+        for d in devices:
+            if d.address not in self.nodes and self.name_filter(d.name or ""):
+                self.add_node(d.address, d.name or "")
+
+    # ---------- per-node state machine ----------
+    async def _run_node(self, node: BleNode):
+        while True:
+            node.state = WAITING
+            await self._slots.acquire()
+            try:
+                cycled = await self._session(node)
+            finally:
+                self._slots.release()
+            if cycled:
+                continue       # straight back to the end of the queue
+            node.state = BACKOFF
+            await asyncio.sleep(self.retry_s)
+
+    async def _session(self, node: BleNode) -> bool:
+        """One connection. True if we hung up on purpose (round robin), False on failure / drop."""
+        loop = asyncio.get_running_loop()
+        dropped = asyncio.Event()
+        drained = asyncio.Event()
+        client = None
+        node.state = CONNECTING
+        try:
+            client = self.client_factory(
+                node.address, disconnected_callback=lambda _c: loop.call_soon_threadsafe(dropped.set)
+            )
+            await asyncio.wait_for(client.connect(), self.connect_timeout_s)
+            if not client.is_connected:
+                raise RuntimeError("BLE connect failed")
+            node.counters["connects"] += 1
+            node.state = CONNECTED
+            node.set_connected(True)
+
+            if self.on_connect is not None:
+                await self.on_connect(client)
+
+            first = node.counters["packets"]
+
+            def on_notify(_sender, data: bytearray):
+                b = bytes(data)
+                node.on_frame(b, self.period_ms)
+                self.on_frame(node.node_id, b)
+                if node.counters["packets"] - first >= self.drain_packets:
+                    drained.set()
+
+            await client.start_notify(self.notify_uuid, on_notify)
+            LOG.info("BLE %s connected, notifications on", node.node_id)
+
+            started = time.monotonic()
+            while not dropped.is_set():
+                if self.cycling:
+                    # give the slot up once drained or after dwell_s, whichever is first
+                    left = self.dwell_s - (time.monotonic() - started)
+                    if drained.is_set() or left <= 0:
+                        break
+                    await _wait_any((dropped, drained), left)
+                else:
+                    # wake up now and then in case more nodes show up and we have to start taking turns
+                    await _wait_any((dropped,), self.dwell_s)
+
+            if dropped.is_set():
+                node.counters["drops"] += 1
+                LOG.warning("BLE %s disconnected (reconnecting...)", node.node_id)
+                return False
+            node.counters["cycles"] += 1
+            return True
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if node.state == CONNECTING:
+                node.counters["connect_failures"] += 1
+            LOG.warning("BLE %s error: %r (reconnecting...)", node.node_id, e)
+            return False
+        finally:
+            node.set_connected(False)
+            await self._disconnect(client)
+
+    async def _disconnect(self, client):
+        try:
+            if client is not None and client.is_connected:
+                try:
+                    await client.stop_notify(self.notify_uuid)
+                except Exception:
+                    pass
+                await client.disconnect()
+        except Exception:
+            pass
+
+    # ---------- metrics ----------
+    def stats(self) -> List[Dict[str, Any]]:
+        return [n.stats() for n in self.nodes.values()]
+
+    async def _stats_loop(self):
+        while True:
+            await asyncio.sleep(self.stats_period_s)
+            for s in self.stats():
+                LOG.info("BLE %s: %s packets=%d (%.2f/min, %.0f B/s) missed=%d (%.1f%%) connects=%d "
+                         "failures=%d drops=%d",
+                         s["node"], s["state"], s["packets"], s["packets_per_min"], s["bytes_per_s"],
+                         s["missed"], s["loss_pct"], s["connects"], s["connect_failures"], s["drops"])
@@ -4,9 +4,12 @@ import concurrent.futures
 from typing import Optional, Dict, Any, Tuple
 from datetime import datetime, timedelta
 
-from bleak import BleakClient, BleakScanner
+from bleak import BleakClient
 
-from db import init_db, db_connect
+from ble_gateway import BleGateway
+from db import init_db, db_open, insert_rows
+from ingest_buffer import IngestBuffer
+from node_payload import NODE_NAME_LENGTH, expected_payload_len, decode_sensor_payload
 
 # import drivers for sensors
 from mcp3008_sensors import MCP3008Sensors
@@ -23,10 +26,18 @@ BLE_DEVICE_NAME = os.getenv("BLE_DEVICE_NAME", "")      # optional
 BLE_ADDRESS     = os.getenv("BLE_ADDRESS", "")          # optional (preferred)
 BLE_NOTIFY_UUID = os.getenv("BLE_NOTIFY_UUID", "")      # Nordic -> Pi notifications (required)
 BLE_TIME_UUID   = os.getenv("BLE_TIME_UUID", "")        # Pi -> Nordic write for time sync (required for time sync)
+# many nodes: comma-separated addresses and/or every advertised name starting with BLE_NAME_PREFIX
+BLE_ADDRESSES   = [a.strip() for a in os.getenv("BLE_ADDRESSES", BLE_ADDRESS).split(",") if a.strip()]
+BLE_NAME_PREFIX = os.getenv("BLE_NAME_PREFIX", "")
+# simultaneous links; with more nodes than this, nodes take turns holding a link for up to BLE_DWELL_S
+BLE_MAX_CONNECTIONS = int(os.getenv("BLE_MAX_CONNECTIONS", "4"))
+BLE_DWELL_S = float(os.getenv("BLE_DWELL_S", "60"))
+BLE_STATS_PERIOD_S = float(os.getenv("BLE_STATS_PERIOD_S", "300"))
 
 # Nordic payload parsing
-NODE_NAME_LENGTH = 8
-node_name = ""
+# "json": decode every notification and store JSON in node_packets
+# "raw":  store the packed frame as a BLOB in node_frames, decoded at upload/query time
+NODE_STORAGE = os.getenv("NODE_STORAGE", "json")
 # Scheduling / time sync target
 PUMP_TARGET_HHMM = os.getenv("PUMP_TARGET_HHMM", "23:00")    # default 11pm
 
@@ -39,7 +50,22 @@ NODE_PERIOD_S = int(os.getenv("NODE_PERIOD_S", "30"))
 SENSOR_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=1)
 
 # SQLite writes can also block; queue writes to not disturb ble
-db_q: "asyncio.Queue[tuple[str, int, Optional[str], Dict[str, Any]]]" = asyncio.Queue(maxsize=2000)
+# memory ring first, then spill file on disk if the writer falls behind (never drops on a full queue)
+INGEST_MEM_MAX = int(os.getenv("INGEST_MEM_MAX", "2000"))
+INGEST_SPILL_PATH = os.getenv("INGEST_SPILL_PATH", DB_PATH + ".spill")
+INGEST_SPILL_MAX_MB = int(os.getenv("INGEST_SPILL_MAX_MB", "256"))
+ingest = IngestBuffer(INGEST_SPILL_PATH, mem_max=INGEST_MEM_MAX, spill_max_bytes=INGEST_SPILL_MAX_MB * 1024 * 1024)
+
+# group commit: writer drains up to DB_BATCH_MAX rows or waits at most
+# DB_BATCH_LATENCY_S after the first row, then commits them in one transaction
+DB_BATCH_MAX = int(os.getenv("DB_BATCH_MAX", "500"))
+DB_BATCH_LATENCY_S = float(os.getenv("DB_BATCH_LATENCY_S", "0.5"))
+
+# one thread owns the long-lived SQLite connection (commits never run on the event loop)
+DB_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+# per-batch writer stats (last batch + running totals)
+db_stats = {"batches": 0, "rows": 0, "last_batch_rows": 0, "last_commit_ms": 0.0, "max_commit_ms": 0.0}
 
 def epoch_s() -> int:
     return int(time.time())
@@ -70,81 +96,6 @@ def next_target_epoch_s(hhmm: str) -> int:
         target += timedelta(days=1)
     return int(target.timestamp())
 
-# unpack payload!!!
-def payload_unpack(node_name_len: int) -> str:
-    # packed struct, little-endian:
-    # uint8  ver
-    # uint32 uptime_ms
-    # uint32 epoch_s
-    # uint16 epoch_ms
-    # char   node_name[N]
-    # int16  mlx_obj_c, mlx_amb_c
-    # int16  sen_temp_c, sen_rh
-    # int16  soil_temp_c
-    # int16  wind_mph
-    # int32  par_ppfd
-    # int16  shortwave_w_m2
-    # int16  pyr_temp_k
-    # int16  longwave_w_m2
-    # int32  weight_integer
-    # int32  weight_fractional
-    # B(1 byte) + I (4 bytes) + I + H (2 bytes) +  8s 
-    return f"<BIIH{node_name_len}s" + "hhhhhh" + "i" + "hhh" + "ii"
-
-def expected_payload_len(node_name_len: int) -> int:
-    return struct.calcsize(payload_unpack(node_name_len))
-
-def decode_sensor_payload_v1(data: bytes, node_name_len: int) -> Dict[str, Any]:
-    fmt = payload_unpack(node_name_len)
-    need = struct.calcsize(fmt)
-    if len(data) != need:
-        # store raw if mismatch
-        return {
-            "decode_error": f"len {len(data)} != expected {need}",
-            "raw_hex": data.hex(),
-        }
-
-    (ver, uptime_ms, epoch_s_val, epoch_ms_val, node_name_b,
-     mlx_obj_c, mlx_amb_c,
-     sen_temp_c, sen_rh,
-     soil_temp_c,
-     wind_mph,
-     par_ppfd,
-     shortwave_w_m2,
-     pyr_temp_k,
-     longwave_w_m2,
-     weight_integer,
-     weight_fractional) = struct.unpack(fmt, data)
-
-    # REMOVE TRAILING ZEROS 
-    node_name = node_name_b.split(b"\x00", 1)[0].decode("utf-8", errors="ignore")
-    dt = datetime.now().astimezone()
-
-
-    return {
-        "ver": ver,
-        "est-timestamp": dt.isoformat(),
-        "node_name": node_name,
-
-        "mlx_obj_c": mlx_obj_c/100,
-        "mlx_amb_c": mlx_amb_c/100,
-
-        "sen_temp_c": sen_temp_c/100,
-        "sen_rh": sen_rh/100,
-
-        "soil_temp_c": soil_temp_c/100,
-        "wind_mph": wind_mph/100,
-
-        "par_ppfd": par_ppfd/100,
-
-        "shortwave_w_m2": shortwave_w_m2/100,
-        "pyr_temp_k": pyr_temp_k/100,
-        "longwave_w_m2": longwave_w_m2/100,
-
-        "weight_in_g": weight_integer + (abs(weight_fractional)/10**6)
-    }
-
-
 DEVICE_ID = "pi-gateway-1"
 sensor_stack = None
 
@@ -211,29 +162,49 @@ def read_local_sensors_blocking() -> Dict[str, Any]:
     }
 
 # db writer
+def write_batch_blocking(conn, batch) -> float:
+    # runs on DB_EXECUTOR; returns commit time in ms
+    sensor_rows = []
+    node_rows = []
+    frame_rows = []
+    for kind, ts, node_id, payload in batch:
+        if kind == "sensor":
+            sensor_rows.append((ts, json.dumps(payload)))
+        elif kind == "node":
+            node_rows.append((ts, node_id, json.dumps(payload)))
+        elif kind == "frame":
+            # ts is the receive time in epoch ms for raw frames
+            frame_rows.append((ts // 1000, ts, node_id, payload[0] if payload else 0, payload))
+
+    t0 = time.perf_counter()
+    insert_rows(conn, sensor_rows, node_rows, frame_rows)
+    return (time.perf_counter() - t0) * 1000.0
+
 async def db_writer_loop():
-    while True:
-        # wait until ther'es something in queue
-        kind, ts, node_id, payload = await db_q.get()
-        try:
-            
-            with db_connect(DB_PATH) as conn:
-                if kind == "sensor":
-                    conn.execute(
-                        "INSERT INTO sensor_samples(ts, payload, uploaded) VALUES (?, ?, 0)",
-                        (ts, json.dumps(payload)),
-                    )
-                elif kind == "node":
-                    conn.execute(
-                        "INSERT INTO node_packets(ts, node_id, payload, uploaded) VALUES (?, ?, ?, 0)",
-                        (ts, node_id, json.dumps(payload)),
-                    )
-                conn.commit()
-        except Exception as e:
-            LOG.exception("DB write failed: %r", e)
-        finally:
-            # exit gracefully
-            db_q.task_done()
+    loop = asyncio.get_running_loop()
+    conn = await loop.run_in_executor(DB_EXECUTOR, db_open, DB_PATH)
+    try:
+        while True:
+            batch = await ingest.get_batch(DB_BATCH_MAX, DB_BATCH_LATENCY_S)
+            if not batch:
+                continue
+            try:
+                commit_ms = await loop.run_in_executor(DB_EXECUTOR, write_batch_blocking, conn, batch)
+
+                db_stats["batches"] += 1
+                db_stats["rows"] += len(batch)
+                db_stats["last_batch_rows"] = len(batch)
+                db_stats["last_commit_ms"] = commit_ms
+                db_stats["max_commit_ms"] = max(db_stats["max_commit_ms"], commit_ms)
+                st = ingest.stats()
+                LOG.info("DB batch committed: %d rows in %.1f ms (mem=%d spill=%dB dropped=%d replay_lag=%.0fs)",
+                         len(batch), commit_ms, st["mem_records"], st["spill_bytes"],
+                         st["dropped"], st["replay_lag_s"])
+            except Exception as e:
+                LOG.exception("DB write failed (%d rows): %r", len(batch), e)
+    finally:
+        ingest.close()
+        await loop.run_in_executor(DB_EXECUTOR, conn.close)
 
 
 
@@ -249,24 +220,13 @@ async def sensor_loop():
             ts = epoch_s()
             payload["_src"] = "pi"
             payload["_ts"] = ts
-            db_q.put_nowait(("sensor", ts, None, payload))
+            ingest.put_nowait(("sensor", ts, None, payload))
             LOG.info("Sensor sample queued")
         except Exception as e:
             LOG.exception("Sensor loop error: %r", e)
 
         await asyncio.sleep(max(0, next_t - time.monotonic()))
 
-async def find_device_address() -> str:
-    if BLE_ADDRESS:
-        return BLE_ADDRESS
-    if not BLE_DEVICE_NAME:
-        raise RuntimeError("Set BLE_ADDRESS or BLE_DEVICE_NAME")
-    LOG.info("Scanning for BLE device name=%s ...", BLE_DEVICE_NAME)
-    dev = await BleakScanner.find_device_by_filter(lambda d, ad: d.name == BLE_DEVICE_NAME, timeout=15.0)
-    if not dev:
-        raise RuntimeError(f"Could not find device named {BLE_DEVICE_NAME}")
-    return dev.address
-
 async def send_time_sync(client: BleakClient):
     """
     look at Zephyr time_sync_write():
@@ -302,78 +262,49 @@ async def send_time_sync(client: BleakClient):
             LOG.warning("Time sync write failed: %r / %r", e1, e2)
 
 
-async def ble_loop():
-    if not BLE_NOTIFY_UUID:
-        raise RuntimeError("BLE_NOTIFY_UUID is required (Nordic notify characteristic UUID)")
-
-    need_len = expected_payload_len(NODE_NAME_LENGTH)
-    LOG.info("Expecting Nordic payload length=%d bytes (NODE_NAME_LENGTH=%d)", need_len, NODE_NAME_LENGTH)
-
-    while True:
-        addr = None
-        client = None
-        disconnected_evt = None
-
-        try:
-            addr = await find_device_address()
-            LOG.info("Connecting BLE: %s", addr)
-
-            loop = asyncio.get_running_loop()
-            disconnected_evt = asyncio.Event()
-
-            def _on_disconnect(_client):
-                loop.call_soon_threadsafe(disconnected_evt.set)
-
-            client = BleakClient(addr, disconnected_callback=_on_disconnect)
-            await client.connect()
-
-            if not client.is_connected:
-                raise RuntimeError("BLE connect failed")
-
-            # send time sync when connected at the start
-            await send_time_sync(client)
-
-            def on_notify(_: int, data: bytearray):
-                b = bytes(data)
-                payload = decode_sensor_payload_v1(b, NODE_NAME_LENGTH)
-
-                ts = epoch_s()
-                payload["_ts"] = ts
-                payload["_src"] = "nordic"
+def on_node_frame(node_id: str, b: bytes):
+    # called from the BLE notification callback
+    if NODE_STORAGE == "raw":
+        # no decoding on the callback path, uploader decodes whole windows at once
+        ingest.put_nowait(("frame", time.time_ns() // 1_000_000, node_id, b))
+        return
 
-                try:
-                    db_q.put_nowait(("node", ts, node_name, payload))
-                except Exception:
-                    LOG.warning("DB queue full; dropping packet")
+    payload = decode_sensor_payload(b, NODE_NAME_LENGTH)
 
-            await client.start_notify(BLE_NOTIFY_UUID, on_notify)
-            LOG.info("Notifications started on %s", BLE_NOTIFY_UUID)
+    ts = epoch_s()
+    payload["_ts"] = ts
+    payload["_src"] = "nordic"
 
-            # Block here until Bleak reports a disconnect
-            await disconnected_evt.wait()
+    # spills to disk instead of dropping when the writer is behind
+    ingest.put_nowait(("node", ts, node_id, payload))
 
-            LOG.warning("BLE disconnected: %s (reconnecting...)", addr)
+def ble_name_filter():
+    if BLE_NAME_PREFIX:
+        return lambda name: name.startswith(BLE_NAME_PREFIX)
+    if BLE_DEVICE_NAME:
+        return lambda name: name == BLE_DEVICE_NAME
+    return None
 
-        except asyncio.CancelledError:
-            raise
+async def ble_loop():
+    if not BLE_NOTIFY_UUID:
+        raise RuntimeError("BLE_NOTIFY_UUID is required (Nordic notify characteristic UUID)")
 
-        except Exception as e:
-            LOG.warning("BLE loop error: %r (reconnecting...)", e)
+    need_len = expected_payload_len(NODE_NAME_LENGTH)
+    LOG.info("Expecting Nordic payload length=%d bytes (NODE_NAME_LENGTH=%d)", need_len, NODE_NAME_LENGTH)
 
-        finally:
-            # clean up before reconnecting
-            try:
-                if client and client.is_connected:
-                    try:
-                        await client.stop_notify(BLE_NOTIFY_UUID)
-                    except Exception:
-                        pass
-                    await client.disconnect()
-            except Exception:
-                pass
-
-        # small delay before attempting reconnect
-        await asyncio.sleep(2)
+    gateway = BleGateway(
+        BLE_NOTIFY_UUID,
+        on_node_frame,
+        addresses=[(a, "") for a in BLE_ADDRESSES],
+        name_filter=ble_name_filter(),
+        max_connections=BLE_MAX_CONNECTIONS,
+        dwell_s=BLE_DWELL_S,
+        sample_period_s=NODE_PERIOD_S,
+        stats_period_s=BLE_STATS_PERIOD_S,
+        # send time sync when connected at the start
+        on_connect=send_time_sync,
+    )
+    await gateway.run()
 
 
 async def main():
@@ -1,10 +1,16 @@
 # db.py
 # instead of saving locally using jsonl files we are instead using sqlite
 # better for threads/cleaner
-import sqlite3
+import os, time, sqlite3, logging
 from contextlib import contextmanager
 
+LOG = logging.getLogger("db")
+
+# tables with an `uploaded` flag; uploaded rows are pruned after the retention horizon
+DATA_TABLES = ("sensor_samples", "node_packets", "node_frames")
+
 SCHEMA = """
+PRAGMA auto_vacuum=INCREMENTAL;
 PRAGMA journal_mode=WAL;
 PRAGMA synchronous=NORMAL;
 
@@ -22,23 +28,323 @@ CREATE TABLE IF NOT EXISTS node_packets (
   payload TEXT NOT NULL,
   uploaded INTEGER NOT NULL DEFAULT 0
 );
-CREATE INDEX IF NOT EXISTS idx_sensor_uploaded_ts ON sensor_samples(uploaded, ts);
-CREATE INDEX IF NOT EXISTS idx_node_uploaded_ts   ON node_packets(uploaded, ts);
+
+CREATE TABLE IF NOT EXISTS node_frames (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  ts INTEGER NOT NULL,          -- receive time, epoch seconds (UTC)
+  ts_ms INTEGER NOT NULL,       -- receive time, epoch milliseconds
+  node_id TEXT,
+  ver INTEGER NOT NULL,         -- leading format byte of the frame
+  frame BLOB NOT NULL,          -- packed struct exactly as notified
+  uploaded INTEGER NOT NULL DEFAULT 0
+);
+
+-- pending rows only: these indexes shrink back as windows are uploaded instead of
+-- growing with the table (replaces the old full (uploaded, ts) indexes)
+DROP INDEX IF EXISTS idx_sensor_uploaded_ts;
+DROP INDEX IF EXISTS idx_node_uploaded_ts;
+DROP INDEX IF EXISTS idx_frames_uploaded_ts;
+CREATE INDEX IF NOT EXISTS idx_sensor_pending_ts ON sensor_samples(ts) WHERE uploaded = 0;
+CREATE INDEX IF NOT EXISTS idx_node_pending_ts   ON node_packets(ts) WHERE uploaded = 0;
+CREATE INDEX IF NOT EXISTS idx_frames_pending_ts ON node_frames(ts) WHERE uploaded = 0;
+
+CREATE TABLE IF NOT EXISTS db_maintenance (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  ts INTEGER NOT NULL,          -- epoch seconds (UTC)
+  db_bytes INTEGER NOT NULL,
+  wal_bytes INTEGER NOT NULL,
+  freelist_pages INTEGER NOT NULL,
+  pruned_rows INTEGER NOT NULL,
+  vacuumed_pages INTEGER NOT NULL,
+  max_lock_ms REAL NOT NULL,    -- longest single write-lock hold during the run
+  duration_ms REAL NOT NULL
+);
 """
 
+def db_open(path: str) -> sqlite3.Connection:
+    # long-lived connection, caller closes it
+    conn = sqlite3.connect(path, timeout=10, isolation_level=None)  # autocommit
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    return conn
+
 @contextmanager
 def db_connect(path: str):
-    conn = sqlite3.connect(path, timeout=10, isolation_level=None)  # autocommit
+    conn = db_open(path)
     try:
-        conn.execute("PRAGMA journal_mode=WAL;")
-        conn.execute("PRAGMA synchronous=NORMAL;")
         yield conn
     finally:
         conn.close()
 
 def init_db(path: str):
-    with db_connect(path) as conn:
+    # plain connection: auto_vacuum only sticks if it runs before WAL mode / the first table on a new file
+    conn = sqlite3.connect(path, timeout=10, isolation_level=None)
+    try:
         for stmt in SCHEMA.strip().split(";"):
             s = stmt.strip()
             if s:
                 conn.execute(s + ";")
+    finally:
+        conn.close()
+
+def insert_rows(conn, sensor_rows, node_rows, frame_rows=()):
+    """
+    Group commit: insert many rows with one executemany per table
+    inside a single transaction (one WAL commit for the whole batch).
+      sensor_rows: [(ts, payload_json), ...]
+      node_rows:   [(ts, node_id, payload_json), ...]
+      frame_rows:  [(ts, ts_ms, node_id, ver, frame_bytes), ...]
+    """
+    conn.execute("BEGIN")
+    try:
+        if sensor_rows:
+            conn.executemany(
+                "INSERT INTO sensor_samples(ts, payload, uploaded) VALUES (?, ?, 0)",
+                sensor_rows,
+            )
+        if node_rows:
+            conn.executemany(
+                "INSERT INTO node_packets(ts, node_id, payload, uploaded) VALUES (?, ?, ?, 0)",
+                node_rows,
+            )
+        if frame_rows:
+            conn.executemany(
+                "INSERT INTO node_frames(ts, ts_ms, node_id, ver, frame, uploaded) VALUES (?, ?, ?, ?, ?, 0)",
+                frame_rows,
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+# ---------- upload bookkeeping ----------
+# a window is claimed by taking the table's high-water id (one rowid b-tree lookup) and
+# acknowledged with a single range UPDATE bounded by that id; rows inserted after the claim
+# have larger ids and stay pending. no id lists, so a window can be any size.
+
+def claim_window(conn, table: str) -> int:
+    """High-water id for a claim (0 if the table is empty)."""
+    return conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0
+
+def iter_pending(conn, table: str, cols: str, window_start: int, window_end: int, max_id: int, chunk: int):
+    """Yield the claimed rows of a window in chunks of `chunk`, in ts order (partial index scan)."""
+    cur = conn.execute(
+        f"""
+        SELECT {cols}
+        FROM {table}
+        WHERE uploaded = 0 AND ts >= ? AND ts < ? AND id <= ?
+        ORDER BY ts ASC
+        """,
+        (window_start, window_end, max_id),
+    )
+    while True:
+        rows = cur.fetchmany(chunk)
+        if not rows:
+            break
+        yield rows
+
+def ack_window(conn, table: str, window_start: int, window_end: int, max_id: int) -> int:
+    """Mark a claimed window uploaded (same predicate as iter_pending). Returns rows marked."""
+    cur = conn.execute(
+        f"UPDATE {table} SET uploaded = 1 WHERE uploaded = 0 AND ts >= ? AND ts < ? AND id <= ?",
+        (window_start, window_end, max_id),
+    )
+    return cur.rowcount
+
+def pending_windows(conn, table: str, period: int, end_ts: int):
+    """[(window_start, rows), ...] oldest first, one scan of the pending index."""
+    return conn.execute(
+        f"""
+        SELECT (ts / ?) * ? AS w, COUNT(*)
+        FROM {table}
+        WHERE uploaded = 0 AND ts < ?
+        GROUP BY w
+        ORDER BY w ASC
+        """,
+        (period, period, end_ts),
+    ).fetchall()
+
+
+# ---------- maintenance (retention, incremental vacuum, checkpoints) ----------
+# every step below is a short autocommit statement, so the collector's writer never waits
+# on maintenance for longer than about one step (lock_budget_ms)
+
+def db_file_sizes(path: str):
+    """(db_bytes, wal_bytes)"""
+    def size(p):
+        try:
+            return os.path.getsize(p)
+        except OSError:
+            return 0
+    return size(path), size(path + "-wal")
+
+def first_id_at(conn, table: str, ts: int) -> int:
+    """
+    Smallest id whose ts >= `ts`, by binary search over the rowid (ids are handed out
+    in receive order, so ts rises with id). One past the last id if every row is older.
+    """
+    lo, hi = conn.execute(f"SELECT MIN(id), MAX(id) FROM {table}").fetchone()
+    if lo is None:
+        return 0
+    hi += 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        # ids have gaps (pruned rows): look at the first row at or after mid
+        row = conn.execute(f"SELECT id, ts FROM {table} WHERE id >= ? ORDER BY id LIMIT 1", (mid,)).fetchone()
+        if row is None or row[1] >= ts:
+            hi = mid
+        else:
+            lo = row[0] + 1
+    return lo
+
+def prune_uploaded(conn, table: str, before_ts: int, lock_budget_ms: float = 200.0,
+                   time_budget_s: float = 30.0, batch_rows: int = 500, pause_s: float = 0.05):
+    """
+    Delete rows with uploaded = 1 and ts < before_ts in small batches.
+    Walks the rowid range below the retention horizon, so no index on uploaded rows is needed.
+    Batch size adapts so one DELETE holds the write lock for about lock_budget_ms.
+    Returns (rows_deleted, max_lock_ms).
+    """
+    deleted = 0
+    max_lock_ms = 0.0
+    deadline = time.monotonic() + time_budget_s
+    end_id = first_id_at(conn, table, before_ts)
+    lo = 0
+    while lo < end_id and time.monotonic() < deadline:
+        hi = conn.execute(
+            f"SELECT MAX(id) FROM (SELECT id FROM {table} WHERE id > ? AND id < ? ORDER BY id LIMIT ?)",
+            (lo, end_id, batch_rows),
+        ).fetchone()[0]
+        if hi is None:
+            break
+        t0 = time.perf_counter()
+        # ts check too: a clock step can leave a newer row below end_id; pending rows are kept
+        cur = conn.execute(
+            f"DELETE FROM {table} WHERE id > ? AND id <= ? AND uploaded = 1 AND ts < ?",
+            (lo, hi, before_ts),
+        )
+        lock_ms = (time.perf_counter() - t0) * 1000.0
+        max_lock_ms = max(max_lock_ms, lock_ms)
+        deleted += cur.rowcount
+        lo = hi
+
+        if lock_ms > lock_budget_ms:
+            batch_rows = max(100, batch_rows // 2)
+        elif lock_ms < lock_budget_ms / 4:
+            batch_rows = min(50000, batch_rows * 2)
+        # let the collector's writer in between batches
+        time.sleep(pause_s)
+    return deleted, max_lock_ms
+
+def incremental_vacuum(conn, lock_budget_ms: float = 200.0, time_budget_s: float = 30.0,
+                       step_pages: int = 64, pause_s: float = 0.05):
+    """
+    Return free pages to the filesystem a few at a time (needs auto_vacuum=INCREMENTAL).
+    Returns (pages_freed, max_lock_ms).
+    """
+    if conn.execute("PRAGMA auto_vacuum;").fetchone()[0] != 2:
+        return 0, 0.0
+    freed = 0
+    max_lock_ms = 0.0
+    deadline = time.monotonic() + time_budget_s
+    while time.monotonic() < deadline:
+        free = conn.execute("PRAGMA freelist_count;").fetchone()[0]
+        if free <= 0:
+            break
+        n = min(free, step_pages)
+        t0 = time.perf_counter()
+        # executescript steps the pragma to completion (execute() would free a single page)
+        conn.executescript(f"PRAGMA incremental_vacuum({int(n)});")
+        lock_ms = (time.perf_counter() - t0) * 1000.0
+        max_lock_ms = max(max_lock_ms, lock_ms)
+        freed += free - conn.execute("PRAGMA freelist_count;").fetchone()[0]
+
+        if lock_ms > lock_budget_ms:
+            step_pages = max(16, step_pages // 2)
+        elif lock_ms < lock_budget_ms / 4:
+            step_pages = min(65536, step_pages * 2)
+        time.sleep(pause_s)
+    return freed, max_lock_ms
+
+def wal_checkpoint(conn, truncate: bool = False):
+    """
+    PASSIVE never blocks the writer; TRUNCATE also shrinks the -wal file back to 0 bytes
+    but only succeeds when no reader is mid-transaction. Returns (busy, log_frames, checkpointed).
+    """
+    mode = "TRUNCATE" if truncate else "PASSIVE"
+    return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode});").fetchone())
+
+def enable_incremental_vacuum(path: str):
+    """
+    One-off for databases created before auto_vacuum=INCREMENTAL was in SCHEMA.
+    Runs a full VACUUM (rewrites the whole file, blocks writers); stop the collector first.
+    """
+    with db_connect(path) as conn:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        conn.execute("VACUUM;")
+
+def run_maintenance(path: str, retention_s: int, quiet: bool = False,
+                    lock_budget_ms: float = 200.0, time_budget_s: float = 60.0,
+                    history_s: int = 90 * 86400) -> dict:
+    """
+    Prune uploaded rows older than retention_s (0 = keep everything), then at quiet times
+    give free pages back and truncate the WAL. Records DB/WAL size in db_maintenance.
+    """
+    t_start = time.perf_counter()
+    deadline = time.monotonic() + time_budget_s
+    now = int(time.time())
+    stats = {"pruned_rows": 0, "vacuumed_pages": 0, "max_lock_ms": 0.0}
+
+    with db_connect(path) as conn:
+        # never wait long for the lock ourselves either
+        conn.execute(f"PRAGMA busy_timeout={int(max(lock_budget_ms, 1))};")
+        try:
+            if retention_s > 0:
+                for table in DATA_TABLES:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    n, lock_ms = prune_uploaded(conn, table, now - retention_s, lock_budget_ms, left)
+                    stats["pruned_rows"] += n
+                    stats["max_lock_ms"] = max(stats["max_lock_ms"], lock_ms)
+                    if n:
+                        LOG.info("Pruned %d uploaded rows older than %d days from %s", n, retention_s // 86400, table)
+                conn.execute("DELETE FROM db_maintenance WHERE ts < ?", (now - history_s,))
+
+            if quiet:
+                left = deadline - time.monotonic()
+                if left > 0:
+                    pages, lock_ms = incremental_vacuum(conn, lock_budget_ms, left)
+                    stats["vacuumed_pages"] = pages
+                    stats["max_lock_ms"] = max(stats["max_lock_ms"], lock_ms)
+                busy, _log, _done = wal_checkpoint(conn, truncate=True)
+                if busy:
+                    LOG.info("WAL truncate skipped (database busy)")
+            else:
+                wal_checkpoint(conn)
+        except sqlite3.OperationalError as e:
+            # "database is locked": the collector is busy, try again next run
+            LOG.info("Maintenance stopped early: %r", e)
+
+        db_bytes, wal_bytes = db_file_sizes(path)
+        stats.update(
+            db_bytes=db_bytes,
+            wal_bytes=wal_bytes,
+            freelist_pages=conn.execute("PRAGMA freelist_count;").fetchone()[0],
+            duration_ms=(time.perf_counter() - t_start) * 1000.0,
+        )
+        try:
+            conn.execute(
+                "INSERT INTO db_maintenance(ts, db_bytes, wal_bytes, freelist_pages, pruned_rows, "
+                "vacuumed_pages, max_lock_ms, duration_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (now, db_bytes, wal_bytes, stats["freelist_pages"], stats["pruned_rows"],
+                 stats["vacuumed_pages"], stats["max_lock_ms"], stats["duration_ms"]),
+            )
+        except sqlite3.OperationalError as e:
+            LOG.info("Could not record maintenance stats: %r", e)
+
+    LOG.info("DB maintenance: db=%.1f MB wal=%.1f MB free_pages=%d pruned=%d vacuumed_pages=%d max_lock=%.0f ms",
+             db_bytes / 1e6, wal_bytes / 1e6, stats["freelist_pages"], stats["pruned_rows"],
+             stats["vacuumed_pages"], stats["max_lock_ms"])
+    return stats
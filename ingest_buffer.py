@@ -0,0 +1,248 @@
+# ingest_buffer.py
+# tiered buffer between the producers (BLE notifications, sensor loop) and the sqlite writer
+#   1) in-memory ring of records (normal path)
+#   2) append-only spill file on disk once memory is full (SD card stall, slow writer)
+#   3) replay from the spill file back to the writer once it has caught up
+# nothing is dropped unless the spill file itself can't be written or hits its size cap
+import os, json, time, struct, asyncio, logging
+from collections import deque
+from typing import Any, Optional, Tuple
+
+LOG = logging.getLogger("ingest")
+
+# spill file record, little-endian:
+# uint32 rec_len (bytes after this field)
+# uint8  kind      (0 = sensor, 1 = node, 2 = raw frame)
+# uint8  body_type (0 = JSON payload, 1 = raw BLE frame)
+# int64  ts
+# uint16 node_id_len
+# char   node_id[node_id_len]
+# body   (rest of record)
+_LEN = struct.Struct("<I")
+_HDR = struct.Struct("<BBqH")
+
+KIND_CODES = {"sensor": 0, "node": 1, "frame": 2}
+KIND_NAMES = {v: k for k, v in KIND_CODES.items()}
+BODY_JSON = 0
+BODY_RAW = 1
+
+Record = Tuple[str, int, Optional[str], Any]
+
+
+def encode_record(kind: str, ts: int, node_id: Optional[str], payload: Any) -> bytes:
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        body_type, body = BODY_RAW, bytes(payload)
+    else:
+        body_type, body = BODY_JSON, json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    nid = (node_id or "").encode("utf-8")
+    rec = _HDR.pack(KIND_CODES[kind], body_type, int(ts), len(nid)) + nid + body
+    return _LEN.pack(len(rec)) + rec
+
+
+def decode_record(rec: bytes) -> Record:
+    kind, body_type, ts, nid_len = _HDR.unpack_from(rec, 0)
+    off = _HDR.size
+    node_id = rec[off:off + nid_len].decode("utf-8") or None
+    body = rec[off + nid_len:]
+    payload = body if body_type == BODY_RAW else json.loads(body)
+    return KIND_NAMES[kind], ts, node_id, payload
+
+
+class IngestBuffer:
+    """
+    Drop-in replacement for the bounded asyncio.Queue in front of the DB writer.
+    put_nowait() never blocks and never raises; get_batch() is awaited by the writer.
+    Must be used from a single event loop thread.
+    """
+
+    def __init__(
+        self,
+        spill_path: str,
+        mem_max: int = 2000,
+        spill_max_bytes: int = 256 * 1024 * 1024,
+        replay_chunk: int = 500,
+    ):
+        self.spill_path = spill_path
+        self.pos_path = spill_path + ".pos"
+        self.mem_max = int(mem_max)
+        self.spill_max_bytes = int(spill_max_bytes)
+        self.replay_chunk = int(replay_chunk)
+
+        self._mem: "deque[Record]" = deque()
+        self._ready = asyncio.Event()
+
+        self._wf = None          # append handle
+        self._rf = None          # replay handle
+        self._write_pos = 0      # bytes written to spill file
+        self._read_pos = 0       # bytes already handed back to the writer
+
+        self.counters = {
+            "received": 0,
+            "dropped": 0,
+            "spilled_records": 0,
+            "spilled_bytes_total": 0,
+            "replayed_records": 0,
+            "replay_lag_s": 0.0,
+        }
+
+        # leftovers from a previous run (crash / restart while spilled) get replayed first
+        if os.path.exists(self.spill_path):
+            self._write_pos = os.path.getsize(self.spill_path)
+            self._read_pos = min(self._load_pos(), self._write_pos)
+            if self._spill_pending():
+                LOG.warning("Found %d bytes of spilled records from a previous run; replaying",
+                            self._write_pos - self._read_pos)
+
+    # ---------- producer side ----------
+    def put_nowait(self, item: Record) -> bool:
+        """Queue one (kind, ts, node_id, payload) record. Returns False only if it was dropped."""
+        self.counters["received"] += 1
+        # once spilling, everything goes to disk until replay catches up (keeps FIFO order)
+        if not self._spill_pending() and len(self._mem) < self.mem_max:
+            self._mem.append(item)
+            self._ready.set()
+            return True
+        return self._spill(item)
+
+    def _spill(self, item: Record) -> bool:
+        try:
+            rec = encode_record(*item)
+            if self._write_pos + len(rec) > self.spill_max_bytes:
+                raise OSError(f"spill file full ({self._write_pos} bytes)")
+            if self._wf is None:
+                if not self._spill_pending():
+                    LOG.warning("Ingest memory full (%d records); spilling to %s", len(self._mem), self.spill_path)
+                self._wf = open(self.spill_path, "ab")
+            self._wf.write(rec)
+            self._wf.flush()
+        except Exception as e:
+            self.counters["dropped"] += 1
+            if self.counters["dropped"] == 1 or self.counters["dropped"] % 100 == 0:
+                LOG.warning("Ingest spill failed, dropping record (dropped=%d): %r", self.counters["dropped"], e)
+            return False
+
+        self._write_pos += len(rec)
+        self.counters["spilled_records"] += 1
+        self.counters["spilled_bytes_total"] += len(rec)
+        self._ready.set()
+        return True
+
+    # ---------- consumer side ----------
+    async def get_batch(self, max_n: int, max_wait_s: float) -> list:
+        """
+        Wait for at least one record, then keep collecting until max_n records
+        or max_wait_s after the first one. Spilled records are replayed in order.
+        """
+        while not self._mem and not self._spill_pending():
+            self._ready.clear()
+            await self._ready.wait()
+
+        batch = []
+        deadline = time.monotonic() + max_wait_s
+        while True:
+            if len(self._mem) < max_n and self._spill_pending():
+                self._replay(max_n - len(self._mem))
+            while self._mem and len(batch) < max_n:
+                batch.append(self._mem.popleft())
+            if len(batch) >= max_n:
+                break
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _replay(self, n: int):
+        if self._wf is not None:
+            self._wf.flush()
+        if self._rf is None:
+            self._rf = open(self.spill_path, "rb")
+        self._rf.seek(self._read_pos)
+
+        limit = max(n, min(self.replay_chunk, self.mem_max - len(self._mem)))
+        got = 0
+        last_ts = None
+        while got < limit and self._read_pos < self._write_pos:
+            head = self._rf.read(_LEN.size)
+            rec_len = _LEN.unpack(head)[0] if len(head) == _LEN.size else -1
+            rec = self._rf.read(rec_len) if rec_len >= 0 else b""
+            if rec_len < 0 or len(rec) < rec_len:
+                # torn record at the tail (crash mid-write): discard it
+                LOG.warning("Discarding truncated spill record at offset %d", self._read_pos)
+                self._read_pos = self._write_pos
+                break
+            self._read_pos += _LEN.size + rec_len
+            try:
+                item = decode_record(rec)
+            except Exception as e:
+                LOG.warning("Discarding corrupt spill record: %r", e)
+                self.counters["dropped"] += 1
+                continue
+            self._mem.append(item)
+            last_ts = item[1]
+            got += 1
+
+        self.counters["replayed_records"] += got
+        if last_ts is not None:
+            self.counters["replay_lag_s"] = max(0.0, time.time() - last_ts)
+
+        if self._read_pos >= self._write_pos:
+            self._reset_spill()
+            LOG.info("Spill replay complete (%d records replayed in total)", self.counters["replayed_records"])
+        else:
+            self._save_pos()
+
+    # ---------- spill file bookkeeping ----------
+    def _spill_pending(self) -> bool:
+        return self._read_pos < self._write_pos
+
+    def _reset_spill(self):
+        for f in (self._wf, self._rf):
+            if f is not None:
+                f.close()
+        self._wf = self._rf = None
+        self._write_pos = self._read_pos = 0
+        self.counters["replay_lag_s"] = 0.0
+        for p in (self.spill_path, self.pos_path):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+    def _load_pos(self) -> int:
+        try:
+            with open(self.pos_path, "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _save_pos(self):
+        # replayed records are handed to the writer at most once, even across restarts
+        try:
+            with open(self.pos_path, "w", encoding="utf-8") as f:
+                f.write(str(self._read_pos))
+        except OSError as e:
+            LOG.warning("Could not save spill replay position: %r", e)
+
+    # ---------- stats ----------
+    def qsize(self) -> int:
+        return len(self._mem)
+
+    def spill_bytes(self) -> int:
+        return self._write_pos - self._read_pos
+
+    def stats(self) -> dict:
+        return dict(self.counters, mem_records=len(self._mem), spill_bytes=self.spill_bytes())
+
+    def close(self):
+        for f in (self._wf, self._rf):
+            if f is not None:
+                f.close()
+        self._wf = self._rf = None
+        if self._spill_pending():
+            self._save_pos()
@@ -0,0 +1,242 @@
+# node_payload.py
+# Nordic node payload formats (shared by collector and uploader)
+# every payload starts with a uint8 `ver`; each version declares its layout once in LAYOUTS
+# and gets a compiled struct.Struct (single packet) and a numpy dtype (bulk decode)
+import struct
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Nordic payload parsing
+NODE_NAME_LENGTH = 8
+
+# layout used when a frame's ver byte isn't registered (older firmware didn't bump it)
+DEFAULT_VER = 1
+
+# struct format char -> numpy little-endian type
+_NP_TYPES = {"B": "u1", "b": "i1", "H": "<u2", "h": "<i2", "I": "<u4", "i": "<i4", "Q": "<u8", "q": "<i8", "f": "<f4", "d": "<f8"}
+
+# (name, struct format, divisor or None, keep in output)
+Field = Tuple[str, str, Optional[float], bool]
+
+
+def _v1_fields(node_name_len: int) -> List[Field]:
+    # packed struct, little-endian:
+    # uint8  ver
+    # uint32 uptime_ms
+    # uint32 epoch_s
+    # uint16 epoch_ms
+    # char   node_name[N]
+    # int16  mlx_obj_c, mlx_amb_c
+    # int16  sen_temp_c, sen_rh
+    # int16  soil_temp_c
+    # int16  wind_mph
+    # int32  par_ppfd
+    # int16  shortwave_w_m2
+    # int16  pyr_temp_k
+    # int16  longwave_w_m2
+    # int32  weight_integer
+    # int32  weight_fractional
+    return [
+        ("ver",               "B",                 None, True),
+        ("uptime_ms",         "I",                 None, False),
+        ("epoch_s",           "I",                 None, False),
+        ("epoch_ms",          "H",                 None, False),
+        ("node_name",         f"{node_name_len}s", None, True),
+        ("mlx_obj_c",         "h",                 100,  True),
+        ("mlx_amb_c",         "h",                 100,  True),
+        ("sen_temp_c",        "h",                 100,  True),
+        ("sen_rh",            "h",                 100,  True),
+        ("soil_temp_c",       "h",                 100,  True),
+        ("wind_mph",          "h",                 100,  True),
+        ("par_ppfd",          "i",                 100,  True),
+        ("shortwave_w_m2",    "h",                 100,  True),
+        ("pyr_temp_k",        "h",                 100,  True),
+        ("longwave_w_m2",     "h",                 100,  True),
+        ("weight_integer",    "i",                 None, False),
+        ("weight_fractional", "i",                 None, False),
+    ]
+
+def _v1_derived(cols: Dict[str, Any]) -> Dict[str, Any]:
+    # works on scalars (single packet) and numpy columns (bulk)
+    w_int, w_frac = cols["weight_integer"], cols["weight_fractional"]
+    if isinstance(w_int, np.ndarray):
+        w_int, w_frac = w_int.astype(np.int64), w_frac.astype(np.int64)
+    return {"weight_in_g": w_int + abs(w_frac) / 10**6}
+
+
+# ver -> (field list builder, derived columns)
+LAYOUTS: Dict[int, Tuple[Callable[[int], List[Field]], Optional[Callable[[Dict[str, Any]], Dict[str, Any]]]]] = {
+    1: (_v1_fields, _v1_derived),
+}
+
+def register_layout(ver: int, fields: Callable[[int], List[Field]], derived=None):
+    """Add a payload version. `fields(node_name_len)` returns the packed field list."""
+    LAYOUTS[int(ver)] = (fields, derived)
+    get_layout.cache_clear()
+
+
+def struct_to_dtype(fmt: str, names: Sequence[str]) -> np.dtype:
+    """numpy structured dtype with the exact byte layout of a little-endian packed struct format."""
+    if fmt[0] != "<":
+        raise ValueError("only packed little-endian formats are supported")
+    types = []
+    i = 1
+    while i < len(fmt):
+        j = i
+        while fmt[j].isdigit():
+            j += 1
+        count = int(fmt[i:j]) if j > i else 1
+        c = fmt[j]
+        if c == "s":
+            types.append(f"S{count}")
+        else:
+            types.extend([_NP_TYPES[c]] * count)
+        i = j + 1
+    if len(types) != len(names):
+        raise ValueError(f"{len(names)} names for {len(types)} fields in {fmt!r}")
+    dt = np.dtype(list(zip(names, types)))
+    assert dt.itemsize == struct.calcsize(fmt)
+    return dt
+
+def _cstr(b: bytes) -> str:
+    # REMOVE TRAILING ZEROS
+    return b.split(b"\x00", 1)[0].decode("utf-8", errors="ignore")
+
+
+class PayloadLayout:
+    """One payload version, compiled for single-packet and bulk decoding."""
+
+    def __init__(self, ver: int, fields: List[Field], derived=None):
+        self.ver = ver
+        self.fields = fields
+        self.derived = derived
+        self.fmt = "<" + "".join(f for _, f, _, _ in fields)
+        self.names = tuple(n for n, _, _, _ in fields)
+        self.struct = struct.Struct(self.fmt)
+        self.size = self.struct.size
+        self.dtype = struct_to_dtype(self.fmt, self.names)
+        self.scales = {n: s for n, _, s, _ in fields if s}
+        self.strings = tuple(n for n, f, _, _ in fields if f.endswith("s"))
+        self.keep = tuple(n for n, _, _, k in fields if k)
+        # name -> (byte offset, size) for reading single fields straight out of a frame
+        self.offsets = {n: (self.dtype.fields[n][1], self.dtype.fields[n][0].itemsize) for n in self.names}
+
+    def _record(self, cols: Dict[str, Any], ts_iso: str) -> Dict[str, Any]:
+        rec = {"ver": cols["ver"], "est-timestamp": ts_iso}
+        for n in self.keep:
+            if n != "ver":
+                rec[n] = cols[n]
+        return rec
+
+    def decode_one(self, data: bytes, ts_iso: str) -> Dict[str, Any]:
+        cols = dict(zip(self.names, self.struct.unpack(data)))
+        for n in self.strings:
+            cols[n] = _cstr(cols[n])
+        for n, s in self.scales.items():
+            cols[n] = cols[n] / s
+        rec = self._record(cols, ts_iso)
+        if self.derived:
+            rec.update(self.derived(cols))
+        return rec
+
+    def decode_columns(self, buf: bytes) -> Dict[str, np.ndarray]:
+        """Decode a concatenation of frames into scaled numpy columns (one pass per column)."""
+        arr = np.frombuffer(buf, dtype=self.dtype)
+        cols = {n: arr[n] for n in self.names}
+        for n, s in self.scales.items():
+            cols[n] = cols[n] / s
+        if self.derived:
+            cols.update(self.derived(cols))
+        return cols
+
+    def decode_many(self, frames: Sequence[bytes], ts_iso: Sequence[str]) -> List[Dict[str, Any]]:
+        cols = self.decode_columns(b"".join(frames))
+        out_names = [n for n in self.keep if n != "ver"] + [n for n in cols if n not in self.names]
+        lists = {n: cols[n].tolist() for n in ["ver"] + out_names}
+        for n in self.strings:
+            lists[n] = [_cstr(b) for b in lists[n]]
+        vers = lists.pop("ver")
+        return [
+            {"ver": vers[k], "est-timestamp": ts_iso[k], **{n: lists[n][k] for n in out_names}}
+            for k in range(len(vers))
+        ]
+
+
+@lru_cache(maxsize=None)
+def get_layout(ver: int, node_name_len: int = NODE_NAME_LENGTH) -> Optional[PayloadLayout]:
+    entry = LAYOUTS.get(ver)
+    if entry is None:
+        return None
+    fields, derived = entry
+    return PayloadLayout(ver, fields(node_name_len), derived)
+
+def layout_for(data: bytes, node_name_len: int = NODE_NAME_LENGTH) -> Optional[PayloadLayout]:
+    """Layout for a frame, keyed by its leading ver byte."""
+    layout = get_layout(data[0], node_name_len) if data else None
+    if layout is None:
+        layout = get_layout(DEFAULT_VER, node_name_len)
+    return layout
+
+
+# unpack payload!!!
+def payload_unpack(node_name_len: int) -> str:
+    return get_layout(1, node_name_len).fmt
+
+def expected_payload_len(node_name_len: int) -> int:
+    return get_layout(1, node_name_len).size
+
+def payload_dtype(node_name_len: int) -> np.dtype:
+    return get_layout(1, node_name_len).dtype
+
+def _decode_error(data: bytes, need: int) -> Dict[str, Any]:
+    # store raw if mismatch
+    return {
+        "decode_error": f"len {len(data)} != expected {need}",
+        "raw_hex": bytes(data).hex(),
+    }
+
+def decode_sensor_payload(data: bytes, node_name_len: int = NODE_NAME_LENGTH) -> Dict[str, Any]:
+    """Single packet, dispatched on the ver byte."""
+    layout = layout_for(data, node_name_len)
+    if len(data) != layout.size:
+        return _decode_error(data, layout.size)
+    return layout.decode_one(data, datetime.now().astimezone().isoformat())
+
+def decode_sensor_payload_v1(data: bytes, node_name_len: int) -> Dict[str, Any]:
+    layout = get_layout(1, node_name_len)
+    if len(data) != layout.size:
+        return _decode_error(data, layout.size)
+    return layout.decode_one(data, datetime.now().astimezone().isoformat())
+
+def frame_uptime_ms(data: bytes, node_name_len: int = NODE_NAME_LENGTH) -> Optional[int]:
+    """Node uptime_ms of a raw frame without decoding the rest (None if unknown / wrong length)."""
+    layout = layout_for(data, node_name_len)
+    if len(data) != layout.size or "uptime_ms" not in layout.offsets:
+        return None
+    off, size = layout.offsets["uptime_ms"]
+    return int.from_bytes(data[off:off + size], "little")
+
+def decode_frames(frames: Sequence[bytes], ts_ms: Sequence[int], node_name_len: int = NODE_NAME_LENGTH) -> List[Dict[str, Any]]:
+    """
+    Lazy decode for raw frames stored in node_frames.
+    Frames are grouped by ver and each group is decoded in one numpy pass,
+    est-timestamp comes from the stored receive time. Order is preserved.
+    """
+    out: List[Dict[str, Any]] = [None] * len(frames)
+    groups: Dict[int, List[int]] = {}
+    for i, f in enumerate(frames):
+        layout = layout_for(f, node_name_len)
+        if len(f) != layout.size:
+            out[i] = _decode_error(f, layout.size)
+        else:
+            groups.setdefault(layout.ver, []).append(i)
+
+    for ver, idx in groups.items():
+        layout = get_layout(ver, node_name_len)
+        ts_iso = [datetime.fromtimestamp(ts_ms[i] / 1000).astimezone().isoformat() for i in idx]
+        for i, rec in zip(idx, layout.decode_many([frames[i] for i in idx], ts_iso)):
+            out[i] = rec
+    return out
@@ -0,0 +1,123 @@
+import asyncio, struct
+
+from ble_gateway import BleGateway
+from node_payload import NODE_NAME_LENGTH, payload_unpack
+
+PERIOD_MS = 100
+FMT = struct.Struct(payload_unpack(NODE_NAME_LENGTH))
+
+
+class FakeClient:
+    """Scripted BleakClient: one frame every `interval_s` while connected, uptime advancing PERIOD_MS per sample."""
+    interval_s = 0.005
+    live = set()
+    max_live = 0
+    uptime = {}          # address -> next sample number (survives reconnects, like the node's clock)
+    fail_connects = {}   # address -> connects that raise before one succeeds
+    skip = {}            # address -> (after n frames on the first link, samples lost)
+    drop_after = {}      # address -> frames on the first link before it drops
+
+    def __init__(self, address, disconnected_callback=None):
+        self.address = address
+        self.cb = disconnected_callback
+        self.is_connected = False
+        self._task = None
+
+    @classmethod
+    def reset(cls, **script):
+        cls.live, cls.max_live, cls.uptime = set(), 0, {}
+        cls.fail_connects = dict(script.get("fail_connects", {}))
+        cls.skip = dict(script.get("skip", {}))
+        cls.drop_after = dict(script.get("drop_after", {}))
+
+    async def connect(self):
+        await asyncio.sleep(0.001)
+        if self.fail_connects.get(self.address, 0) > 0:
+            self.fail_connects[self.address] -= 1
+            raise OSError("le-connection-abort-by-local")
+        self.is_connected = True
+        FakeClient.live.add(self.address)
+        FakeClient.max_live = max(FakeClient.max_live, len(FakeClient.live))
+
+    async def start_notify(self, _uuid, handler):
+        async def run():
+            sent = 0
+            while self.is_connected:
+                await asyncio.sleep(self.interval_s)
+                if not self.is_connected:
+                    break
+                k = self.uptime.get(self.address, 0)
+                if self.skip.get(self.address, (None,))[0] == sent:
+                    k += self.skip.pop(self.address)[1]
+                handler(0, bytearray(FMT.pack(1, k * PERIOD_MS, 1735707600 + k, 0, self.address[-8:].encode(),
+                                              *[0] * 6, 0, 0, 0, 0, 0, 0)))
+                self.uptime[self.address] = k + 1
+                sent += 1
+                if self.drop_after.get(self.address) == sent:
+                    del self.drop_after[self.address]
+                    self._down()
+                    self.cb(self)
+        self._task = asyncio.ensure_future(run())
+
+    def _down(self):
+        self.is_connected = False
+        FakeClient.live.discard(self.address)
+
+    async def stop_notify(self, _uuid):
+        if self._task:
+            self._task.cancel()
+
+    async def disconnect(self):
+        self._down()
+        if self._task:
+            self._task.cancel()
+
+
+def run_gateway(addresses, seconds, **kwargs):
+    async def run():
+        gw = BleGateway("notify", lambda node_id, b: None, addresses=[(a, a[-8:]) for a in addresses],
+                        sample_period_s=PERIOD_MS / 1000, retry_s=0.02, client_factory=FakeClient, **kwargs)
+        task = asyncio.ensure_future(gw.run())
+        await asyncio.sleep(seconds)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return gw
+    return asyncio.run(run())
+
+
+def test_more_nodes_than_slots_take_turns():
+    nodes = [f"AA:00:00:00:0{i}" for i in range(5)]
+    FakeClient.reset()
+    gw = run_gateway(nodes, 0.6, max_connections=2, drain_packets=3, dwell_s=1.0)
+    assert gw.cycling
+    assert FakeClient.max_live == 2
+    st = {s["address"]: s for s in gw.stats()}
+    for a in nodes:
+        assert st[a]["packets"] >= 3
+        assert st[a]["cycles"] >= 1
+        assert st[a]["drops"] == 0
+        assert st[a]["missed"] == 0
+
+
+def test_drop_reconnects_and_counts_missed_samples():
+    a = "AA:00:00:00:01"
+    FakeClient.reset(skip={a: (3, 2)}, drop_after={a: 5})
+    gw = run_gateway([a], 0.3, max_connections=4)
+    s = gw.stats()[0]
+    assert not gw.cycling
+    assert s["drops"] == 1
+    assert s["connects"] == 2
+    assert s["state"] == "connected"
+    assert s["packets"] > 5
+    assert s["missed"] == 2
+    assert s["reboots"] == 0
+
+
+def test_connect_failures_are_retried():
+    a = "AA:00:00:00:01"
+    FakeClient.reset(fail_connects={a: 3})
+    gw = run_gateway([a], 0.5, max_connections=1)
+    s = gw.stats()[0]
+    assert s["connect_failures"] == 3
+    assert s["connects"] == 1
+    assert s["packets"] > 0
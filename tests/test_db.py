@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from db import ack_window, claim_window, db_open, init_db, insert_rows, iter_pending, pending_windows
+
+WS = 1735707600
+
+
+@pytest.fixture
+def conn(tmp_path):
+    path = str(tmp_path / "t.db")
+    init_db(path)
+    c = db_open(path)
+    yield c
+    c.close()
+
+
+def add(conn, *ts):
+    insert_rows(conn, [(t, json.dumps({"t": t})) for t in ts], [])
+
+
+def ids(conn, ws, we, max_id, chunk=2):
+    return [r[0] for rows in iter_pending(conn, "sensor_samples", "id, ts", ws, we, max_id, chunk) for r in rows]
+
+
+def test_claim_on_empty_table(conn):
+    assert claim_window(conn, "sensor_samples") == 0
+    assert ids(conn, WS, WS + 300, 0) == []
+
+
+def test_rows_after_the_claim_are_not_read_or_acked(conn):
+    add(conn, WS + 5, WS + 1, WS + 3)
+    max_id = claim_window(conn, "sensor_samples")
+    assert max_id == 3
+    # lands in the same window while the upload is in flight
+    add(conn, WS + 2)
+
+    # ts order, chunked, only up to the claim
+    assert ids(conn, WS, WS + 300, max_id) == [2, 3, 1]
+    assert ack_window(conn, "sensor_samples", WS, WS + 300, max_id) == 3
+    assert ids(conn, WS, WS + 300, claim_window(conn, "sensor_samples")) == [4]
+    assert pending_windows(conn, "sensor_samples", 300, WS + 300) == [(WS, 1)]
+
+
+def test_ack_stays_inside_the_window(conn):
+    add(conn, WS - 1, WS, WS + 299, WS + 300)
+    max_id = claim_window(conn, "sensor_samples")
+    assert ack_window(conn, "sensor_samples", WS, WS + 300, max_id) == 2
+    # already marked rows are not counted again
+    assert ack_window(conn, "sensor_samples", WS, WS + 300, max_id) == 0
+    left = conn.execute("SELECT ts FROM sensor_samples WHERE uploaded = 0 ORDER BY ts").fetchall()
+    assert [r[0] for r in left] == [WS - 1, WS + 300]
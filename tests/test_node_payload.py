@@ -0,0 +1,64 @@
+import struct
+
+import pytest
+
+import node_payload as npl
+from node_payload import (LAYOUTS, decode_frames, decode_sensor_payload, frame_uptime_ms, get_layout,
+                          payload_unpack, register_layout)
+
+
+def v1_frame(i: int = 0, ver: int = 1, name: bytes = b"node0001") -> bytes:
+    return struct.pack(payload_unpack(npl.NODE_NAME_LENGTH), ver, 1000 + i, 1700000000, 5, name,
+                       2150, 2010, 1980, 5520, 1730, 120, 81240, 4550, 29310, 3502, 1234, 567800)
+
+
+def _v2_fields(node_name_len):
+    return [("ver", "B", None, True), ("uptime_ms", "I", None, False), ("co2_ppm", "H", None, True),
+            ("temp_c", "h", 10, True)]
+
+
+@pytest.fixture
+def v2():
+    register_layout(2, _v2_fields)
+    yield struct.Struct("<BIHh")
+    LAYOUTS.pop(2)
+    get_layout.cache_clear()
+
+
+def test_v1_decode_scales_and_derives():
+    rec = decode_sensor_payload(v1_frame())
+    assert rec["ver"] == 1 and rec["node_name"] == "node0001"
+    assert rec["mlx_obj_c"] == 21.5 and rec["par_ppfd"] == 812.4
+    assert rec["weight_in_g"] == pytest.approx(1234.5678)
+    assert "uptime_ms" not in rec
+
+
+def test_bulk_matches_single():
+    frames = [v1_frame(i) for i in range(50)]
+    bulk = decode_frames(frames, [1700000000000 + i for i in range(50)])
+    for f, b in zip(frames, bulk):
+        one = decode_sensor_payload(f)
+        one.pop("est-timestamp"), b.pop("est-timestamp")
+        assert one == pytest.approx(b)
+
+
+def test_unknown_ver_falls_back_to_default_layout():
+    rec = decode_sensor_payload(v1_frame(ver=9))
+    assert rec["ver"] == 9 and rec["node_name"] == "node0001" and rec["wind_mph"] == 1.2
+
+
+def test_wrong_length_is_kept_raw():
+    bad = v1_frame()[:-3]
+    rec = decode_sensor_payload(bad)
+    assert "decode_error" in rec and rec["raw_hex"] == bad.hex()
+    assert frame_uptime_ms(bad) is None
+
+
+def test_registered_version_dispatch_keeps_order(v2):
+    frames = [v1_frame(0), v2.pack(2, 77, 415, 213), b"\x02\x00", v1_frame(1), v2.pack(2, 78, 420, -15)]
+    out = decode_frames(frames, [1700000000000] * len(frames))
+    assert [r.get("ver") for r in out] == [1, 2, None, 1, 2]
+    assert out[1]["co2_ppm"] == 415 and out[1]["temp_c"] == 21.3
+    assert out[4]["temp_c"] == -1.5
+    assert "decode_error" in out[2]
+    assert frame_uptime_ms(frames[1]) == 77 and frame_uptime_ms(frames[3]) == 1001
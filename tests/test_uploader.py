@@ -0,0 +1,67 @@
+import gzip, json, os
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from upload_formats import get_format
+
+
+@pytest.fixture
+def up(monkeypatch):
+    # uploader reads S3_BUCKET and builds its client at import; swap in a client created under the mock
+    monkeypatch.setenv("S3_BUCKET", "test-bucket")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    with mock_aws():
+        import uploader
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=uploader.S3_BUCKET)
+        monkeypatch.setattr(uploader, "s3", client)
+        yield uploader
+
+
+def get_body(up, key):
+    return up.s3.get_object(Bucket=up.S3_BUCKET, Key=key)["Body"].read()
+
+
+def test_small_object_is_single_put(up):
+    with up.S3StreamUpload(up.S3_BUCKET, "t/small", up.S3_MIN_PART_BYTES) as sink:
+        sink.write(b"hello ")
+        sink.write(b"world")
+    assert sink._upload_id is None
+    assert sink.bytes_out == 11
+    assert get_body(up, "t/small") == b"hello world"
+
+
+def test_large_object_is_multipart(up):
+    part = up.S3_MIN_PART_BYTES
+    body = os.urandom(2 * part + 12345)
+    with up.S3StreamUpload(up.S3_BUCKET, "t/big", part) as sink:
+        for i in range(0, len(body), 1 << 20):
+            sink.write(body[i:i + (1 << 20)])
+    assert sink._upload_id is not None
+    assert [p["PartNumber"] for p in sink._parts] == [1, 2, 3]
+    assert sink.bytes_out == len(body)
+    assert get_body(up, "t/big") == body
+
+
+def test_failed_multipart_is_aborted(up):
+    part = up.S3_MIN_PART_BYTES
+    with pytest.raises(RuntimeError):
+        with up.S3StreamUpload(up.S3_BUCKET, "t/abort", part) as sink:
+            sink.write(os.urandom(part + 1))
+            raise RuntimeError("reader died")
+    assert up.s3.list_multipart_uploads(Bucket=up.S3_BUCKET).get("Uploads", []) == []
+    assert "Contents" not in up.s3.list_objects_v2(Bucket=up.S3_BUCKET, Prefix="t/abort")
+
+
+def test_upload_records_jsonl_roundtrip(up):
+    # incompressible payloads so the gzip stream spans several parts
+    chunks = [[{"i": i * 100 + j, "x": os.urandom(300).hex()} for j in range(100)] for i in range(200)]
+    nbytes = up.upload_records(up.S3_BUCKET, "t/rows.jsonl.gz", get_format("jsonl", "sensor_samples"), iter(chunks))
+    body = get_body(up, "t/rows.jsonl.gz")
+    assert nbytes == len(body) > up.S3_MIN_PART_BYTES
+    rows = [json.loads(line) for line in gzip.decompress(body).splitlines()]
+    assert rows == [r for c in chunks for r in c]
+
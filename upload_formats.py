@@ -0,0 +1,191 @@
+# upload_formats.py
+# output formats for the S3 window objects
+#   jsonl   - gzip JSON lines, one record per line (default, what downstream has always read)
+#   parquet - typed columns, zstd; nested sensor payloads are flattened to <section>_<key> columns
+# a format writes chunks of records (lists of dicts) into a write-only file object (S3StreamUpload)
+import os, json, gzip, logging
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from node_payload import get_layout
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only needed for UPLOAD_FORMAT=parquet
+    pa = None
+    pq = None
+
+LOG = logging.getLogger("uploader")
+
+# spectrometer pixels per spectrum (fixed-size list column)
+SPEC_POINTS = int(os.getenv("SPEC_POINTS", "2048"))
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+
+
+class JsonlGzFormat:
+    name = "jsonl"
+    ext = ".jsonl.gz"
+    put_kwargs = {"ContentType": "application/x-ndjson", "ContentEncoding": "gzip"}
+
+    def __init__(self, table: str):
+        self.table = table
+
+    def write(self, sink, chunks: Iterable[List[Dict[str, Any]]]):
+        with gzip.GzipFile(fileobj=sink, mode="wb") as gz:
+            for records in chunks:
+                gz.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records).encode("utf-8"))
+
+
+# ---------- parquet column layouts ----------
+# (path into the record, arrow type name); column name is the path joined with "_"
+# anything in a record that isn't declared ends up as JSON in the `extra` column, so nothing is lost
+def _sensor_columns() -> List[Tuple[Tuple[str, ...], str]]:
+    return [
+        (("est-timestamp",), "string"),
+        (("device_id",), "string"),
+        (("_src",), "string"),
+        (("_ts",), "int64"),
+        (("_ts_db",), "int64"),
+        (("mcp3008", "sq214_1", "ppfd"), "float64"),
+        (("mcp3008", "wind", "wind_mph"), "float64"),
+        (("i2c", "scd41", "co2_ppm"), "int64"),
+        (("i2c", "scd41", "temp_c"), "float64"),
+        (("i2c", "scd41", "rh_pct"), "float64"),
+        (("i2c", "lps28", "pressure_hpa"), "float64"),
+        (("i2c", "lps28", "temp_c"), "float64"),
+        (("sn522", "cal_sw_up_w"), "float64"),
+        (("sn522", "cal_sw_down_w"), "float64"),
+        (("sn522", "cal_lw_up_w"), "float64"),
+        (("sn522", "cal_lw_down_w"), "float64"),
+        (("sn522", "sw_net_w"), "float64"),
+        (("sn522", "lw_net_w"), "float64"),
+        (("sn522", "net_total_w"), "float64"),
+        (("sn522", "albedo"), "float64"),
+        (("sn522", "lw_up_temp"), "float64"),
+        (("sn522", "lw_down_temp"), "float64"),
+        (("sq522", "calibrated_output"), "float64"),
+        (("spectrometer", "raw_y"), "spectrum"),
+    ]
+
+def _node_columns() -> List[Tuple[Tuple[str, ...], str]]:
+    layout = get_layout(1)
+    cols = [(("ver",), "int64"), (("est-timestamp",), "string")]
+    for name, fmt, scale, keep in layout.fields:
+        if keep and name != "ver":
+            cols.append(((name,), "string" if fmt.endswith("s") else ("float64" if scale else "int64")))
+    cols += [
+        (("weight_in_g",), "float64"),
+        (("_src",), "string"),
+        (("_ts",), "int64"),
+        (("_ts_db",), "int64"),
+        (("decode_error",), "string"),
+        (("raw_hex",), "string"),
+    ]
+    return cols
+
+TABLE_COLUMNS = {
+    "sensor_samples": _sensor_columns,
+    "node_packets": _node_columns,
+    "node_frames": _node_columns,
+}
+
+
+def _arrow_type(name: str):
+    if name == "spectrum":
+        return pa.list_(pa.float32(), SPEC_POINTS)
+    return {"string": pa.string(), "int64": pa.int64(), "float64": pa.float64()}[name]
+
+def _get(rec: Dict[str, Any], path: Sequence[str]):
+    v = rec
+    for p in path:
+        if not isinstance(v, dict):
+            return None
+        v = v.get(p)
+    return v
+
+def _rest(rec: Dict[str, Any], tree: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of rec without the declared columns (tree: nested dict of declared paths, leaves are None)."""
+    out = {}
+    for k, v in rec.items():
+        if k not in tree:
+            out[k] = v
+        elif tree[k] is not None and isinstance(v, dict):
+            sub = _rest(v, tree[k])
+            if sub:
+                out[k] = sub
+        elif tree[k] is not None and v is not None:
+            # a section that should be a dict but isn't (e.g. placeholder string)
+            out[k] = v
+    return out
+
+def _fits(v, typ: str) -> bool:
+    if v is None:
+        return True
+    if typ == "float64":
+        return isinstance(v, (int, float)) and not isinstance(v, bool)
+    if typ == "int64":
+        return isinstance(v, int) and not isinstance(v, bool)
+    if typ == "string":
+        return isinstance(v, str)
+    # spectrum
+    return isinstance(v, list) and len(v) == SPEC_POINTS
+
+
+class ParquetFormat:
+    name = "parquet"
+    ext = ".parquet"
+    put_kwargs = {"ContentType": "application/vnd.apache.parquet"}
+
+    def __init__(self, table: str):
+        if pa is None:
+            raise RuntimeError("UPLOAD_FORMAT=parquet needs pyarrow (pip install pyarrow)")
+        self.table = table
+        self.columns = TABLE_COLUMNS[table]()
+        fields = [pa.field("_".join(p).replace("-", "_"), _arrow_type(t)) for p, t in self.columns]
+        fields.append(pa.field("extra", pa.string()))
+        self.schema = pa.schema(fields)
+
+        self._tree: Dict[str, Any] = {}
+        for path, _t in self.columns:
+            node = self._tree
+            for p in path[:-1]:
+                node = node.setdefault(p, {})
+            node[path[-1]] = None
+
+    def to_table(self, records: List[Dict[str, Any]]):
+        data = [[] for _ in range(len(self.columns) + 1)]
+        for rec in records:
+            rest = _rest(rec, self._tree)
+            for i, (path, typ) in enumerate(self.columns):
+                v = _get(rec, path)
+                if not _fits(v, typ):
+                    # wrong type (sensor error path, spectrum of another length): keep it in `extra`
+                    rest["_".join(path)] = v
+                    v = None
+                data[i].append(v)
+            data[-1].append(json.dumps(rest, separators=(",", ":")) if rest else None)
+        return pa.Table.from_arrays(
+            [pa.array(col, type=f.type) for col, f in zip(data, self.schema)], schema=self.schema
+        )
+
+    def write(self, sink, chunks: Iterable[List[Dict[str, Any]]]):
+        # one row group per chunk
+        writer = pq.ParquetWriter(sink, self.schema, compression=PARQUET_COMPRESSION)
+        try:
+            for records in chunks:
+                if records:
+                    writer.write_table(self.to_table(records))
+        finally:
+            writer.close()
+
+
+FORMATS = {
+    "jsonl": JsonlGzFormat,
+    "parquet": ParquetFormat,
+}
+
+def get_format(name: str, table: str):
+    try:
+        return FORMATS[name](table)
+    except KeyError:
+        raise ValueError(f"Unknown upload format {name!r} (choose from {', '.join(FORMATS)})")
@@ -1,11 +1,16 @@
 # uploader.py
-import os, time, json, gzip, logging, sqlite3
+import os, time, json, random, logging, sqlite3, itertools
+import concurrent.futures
+from contextlib import closing
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 import boto3
+from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
 
-from db import init_db
+from db import init_db, run_maintenance, claim_window, iter_pending, ack_window, pending_windows
+from node_payload import decode_frames
+from upload_formats import get_format
 
 LOG = logging.getLogger("uploader")
 
@@ -20,97 +25,346 @@ PFX_NODES   = os.getenv("S3_PREFIX_NODES", "nodes")
 
 UPLOAD_PERIOD_S = int(os.getenv("UPLOAD_PERIOD_S", "300")) # 5 x 60 s for now
 
+# object format: "jsonl" (gzip JSON lines) or "parquet" (zstd columns, needs pyarrow)
+UPLOAD_FORMAT = os.getenv("UPLOAD_FORMAT", "jsonl")
+
+# streaming upload: rows read per cursor fetch, and S3 multipart part size
+# (memory stays around one part + one chunk no matter how big the window is)
+UPLOAD_CHUNK_ROWS = int(os.getenv("UPLOAD_CHUNK_ROWS", "2000"))
+S3_MIN_PART_BYTES = 5 * 1024 * 1024   # S3 minimum for every part except the last
+S3_PART_BYTES = int(float(os.getenv("S3_PART_MB", "8")) * 1024 * 1024)
+
+# catch-up: every cycle uploads ALL pending full windows (not just the previous one), oldest first
+# each (table, window) is one compress+PUT job on the upload thread pool
+CATCHUP_CONCURRENCY = int(os.getenv("CATCHUP_CONCURRENCY", "4"))      # windows uploading at once
+CATCHUP_MAX_WPS = float(os.getenv("CATCHUP_MAX_WPS", "4"))            # rate budget, window objects started per second (0 = no limit)
+CATCHUP_BUDGET_S = float(os.getenv("CATCHUP_BUDGET_S", str(UPLOAD_PERIOD_S * 0.8)))  # stop starting new windows after this
+
+# SQLite housekeeping, runs between upload cycles (the uploader is the one that knows what's uploaded)
+DB_RETENTION_DAYS = float(os.getenv("DB_RETENTION_DAYS", "30"))      # keep uploaded rows this long, 0 = forever
+MAINT_PERIOD_S = int(os.getenv("MAINT_PERIOD_S", "3600"))
+MAINT_LOCK_BUDGET_MS = float(os.getenv("MAINT_LOCK_BUDGET_MS", "200"))  # max time one step may hold the write lock
+MAINT_QUIET_HOURS = os.getenv("MAINT_QUIET_HOURS", "1-5")             # local hours for vacuum + WAL truncate
+
+UPLOAD_TABLES = (
+    ("sensor_samples", PFX_SENSORS),
+    ("node_packets",   PFX_NODES),
+    ("node_frames",    PFX_NODES),
+)
+
+UPLOAD_ERRORS = (sqlite3.Error, BotoCoreError, ClientError, json.JSONDecodeError)
+
+# backlog report from the last cycle
+catchup_stats = {"backlog_windows": 0, "backlog_objects": 0, "backlog_rows": 0,
+                 "rate_wps": 0.0, "eta_s": 0.0, "uploaded_objects": 0, "failed_objects": 0}
+
+# S3 connection pool shared by all upload threads (keep-alive, so parallel jobs reuse TLS connections
+# instead of paying a handshake per request on cellular), botocore retries with jittered backoff
+S3_MAX_POOL = int(os.getenv("S3_MAX_POOL", str(max(10, 2 * CATCHUP_CONCURRENCY))))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", "5"))
+S3_CONNECT_TIMEOUT_S = float(os.getenv("S3_CONNECT_TIMEOUT_S", "10"))
+S3_READ_TIMEOUT_S = float(os.getenv("S3_READ_TIMEOUT_S", "60"))
+
+# whole-job retries (e.g. multipart upload that failed halfway), full-jitter exponential backoff
+UPLOAD_JOB_RETRIES = int(os.getenv("UPLOAD_JOB_RETRIES", "2"))
+UPLOAD_RETRY_BASE_S = float(os.getenv("UPLOAD_RETRY_BASE_S", "2"))
+UPLOAD_RETRY_MAX_S = 30.0
+
 # set up aws
-s3 = boto3.client("s3", region_name=S3_REGION)
+s3 = boto3.client(
+    "s3",
+    region_name=S3_REGION,
+    config=Config(
+        max_pool_connections=S3_MAX_POOL,
+        tcp_keepalive=True,
+        connect_timeout=S3_CONNECT_TIMEOUT_S,
+        read_timeout=S3_READ_TIMEOUT_S,
+        retries={"max_attempts": S3_MAX_ATTEMPTS, "mode": "standard"},
+    ),
+)
 
 # round down 
 def floor_window(ts: int, period: int) -> int:
     return (ts // period) * period
 
 # set file title 
-def s3_key(prefix: str, window_start_ts: int) -> str:
+def s3_key(prefix: str, window_start_ts: int, suffix: str = "", ext: str = ".jsonl.gz") -> str:
     dt = datetime.fromtimestamp(window_start_ts, tz=ZoneInfo("America/New_York"))
-    return f"{prefix}/{dt:%Y/%m/%d/%H-%M}.jsonl.gz"
+    return f"{prefix}/{dt:%Y/%m/%d/%H-%M}{suffix}{ext}"
 
 # set 
-def fetch_rows(conn, table: str, window_start: int, window_end: int):
-    cur = conn.cursor()
-    cur.execute(
-        f"""
-        SELECT id, ts, payload
-        FROM {table}
-        WHERE uploaded = 0 AND ts >= ? AND ts < ?
-        ORDER BY ts ASC
-        """,
-        (window_start, window_end),
-    )
-    return cur.fetchall()
-
-def mark_uploaded(conn, table: str, ids):
-    if not ids:
-        return
-    cur = conn.cursor()
-    cur.execute(
-        f"UPDATE {table} SET uploaded = 1 WHERE id IN ({','.join(['?']*len(ids))})",
-        ids,
-    )
-
-def upload_jsonl_gz(bucket: str, key: str, records: list[dict]):
-    blob = b"".join((json.dumps(r, separators=(",", ":")) + "\n").encode("utf-8") for r in records)
-    gz = gzip.compress(blob)
-    s3.put_object(
-        Bucket=bucket,
-        Key=key,
-        Body=gz,
-        ContentType="application/x-ndjson",
-        ContentEncoding="gzip",
-    )
+class S3StreamUpload:
+    """
+    Write-only file object that ships an S3 object in parts while it is being written.
+    Buffers at most `part_size` bytes; the first full part starts a multipart upload.
+    Objects smaller than one part go out as a single put_object.
+    """
 
-def window_upload(conn, table: str, prefix: str, window_start: int, window_end: int) -> int:
-    rows = fetch_rows(conn, table, window_start, window_end)
-    if not rows:
-        return 0
+    def __init__(self, bucket: str, key: str, part_size: int, **put_kwargs):
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(int(part_size), S3_MIN_PART_BYTES)
+        self.put_kwargs = put_kwargs
+        self.bytes_out = 0
+        self._buf = bytearray()
+        self._upload_id = None
+        self._parts = []
 
-    ids = []
+    def write(self, b) -> int:
+        self._buf += b
+        while len(self._buf) >= self.part_size:
+            self._upload_part(bytes(self._buf[:self.part_size]))
+            del self._buf[:self.part_size]
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def tell(self) -> int:
+        return self.bytes_out + len(self._buf)
+
+    @property
+    def closed(self) -> bool:
+        return False
+
+    def _upload_part(self, body: bytes):
+        if self._upload_id is None:
+            resp = s3.create_multipart_upload(Bucket=self.bucket, Key=self.key, **self.put_kwargs)
+            self._upload_id = resp["UploadId"]
+        n = len(self._parts) + 1
+        resp = s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=n, Body=body)
+        self._parts.append({"ETag": resp["ETag"], "PartNumber": n})
+        self.bytes_out += len(body)
+
+    def close(self):
+        if self._upload_id is None:
+            body = bytes(self._buf)
+            s3.put_object(Bucket=self.bucket, Key=self.key, Body=body, **self.put_kwargs)
+            self.bytes_out += len(body)
+        else:
+            if self._buf:
+                self._upload_part(bytes(self._buf))
+            s3.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                MultipartUpload={"Parts": self._parts},
+            )
+        self._buf = bytearray()
+
+    def abort(self):
+        if self._upload_id is not None:
+            try:
+                s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            except (BotoCoreError, ClientError) as e:
+                LOG.warning("Abort multipart upload failed for %s: %r", self.key, e)
+        self._buf = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+def upload_records(bucket: str, key: str, fmt, chunks) -> int:
+    """Stream chunks of records through the output format into S3. Returns object bytes."""
+    with S3StreamUpload(bucket, key, S3_PART_BYTES, **fmt.put_kwargs) as sink:
+        fmt.write(sink, chunks)
+    return sink.bytes_out
+
+def json_records(rows):
     records = []
     for _id, ts, payload in rows:
-        ids.append(_id)
         rec = json.loads(payload)
         rec["_ts_db"] = ts
         records.append(rec)
+    return records
 
-    key = s3_key(prefix, window_start)
-    upload_jsonl_gz(S3_BUCKET, key, records)
+def frame_records(rows):
+    # raw frames are decoded here, one vectorized pass per chunk
+    records = decode_frames([r[4] for r in rows], [r[2] for r in rows])
+    for (_id, ts, ts_ms, node_id, _frame), rec in zip(rows, records):
+        rec["_ts"] = ts
+        rec["_src"] = "nordic"
+        rec["_ts_db"] = ts
+    return records
 
-    mark_uploaded(conn, table, ids)
+def upload_window(conn, table: str, prefix: str, window_start: int, window_end: int):
+    """
+    Claim, read, encode and upload one window. Returns (rows, max_id, object_bytes, key);
+    does not mark: ack_window(..., max_id) does that once the object is in S3.
+    """
+    max_id = claim_window(conn, table)
+    cols = "id, ts, ts_ms, node_id, frame" if table == "node_frames" else "id, ts, payload"
+    chunks = iter_pending(conn, table, cols, window_start, window_end, max_id, UPLOAD_CHUNK_ROWS)
+    first = next(chunks, None)
+    if first is None:
+        return 0, 0, 0, None
+
+    to_records = frame_records if table == "node_frames" else json_records
+    fmt = get_format(UPLOAD_FORMAT, table)
+    stats = {"rows": 0}
+
+    def record_chunks():
+        for rows in itertools.chain([first], chunks):
+            stats["rows"] += len(rows)
+            yield to_records(rows)
+
+    # same folder as node_packets, separate object so both can exist for one window
+    key = s3_key(prefix, window_start, "-raw" if table == "node_frames" else "", fmt.ext)
+    nbytes = upload_records(S3_BUCKET, key, fmt, record_chunks())
+    return stats["rows"], max_id, nbytes, key
+
+def window_upload(conn, table: str, prefix: str, window_start: int, window_end: int) -> int:
+    rows, max_id, nbytes, key = upload_window(conn, table, prefix, window_start, window_end)
+    if not rows:
+        return 0
+
+    ack_window(conn, table, window_start, window_end, max_id)
     conn.commit()
 
-    LOG.info("Uploaded %d rows from %s to s3://%s/%s", len(ids), table, S3_BUCKET, key)
-    return len(ids)
+    LOG.info("Uploaded %d rows (%d bytes) from %s to s3://%s/%s", rows, nbytes, table, S3_BUCKET, key)
+    return rows
+
+def _upload_job(table: str, prefix: str, window_start: int):
+    # runs on a worker thread with its own read connection; marking happens on the caller's connection
+    for attempt in range(UPLOAD_JOB_RETRIES + 1):
+        try:
+            with closing(sqlite3.connect(DB_PATH, timeout=10)) as conn:
+                return upload_window(conn, table, prefix, window_start, window_start + UPLOAD_PERIOD_S)
+        except (BotoCoreError, ClientError) as e:
+            if attempt >= UPLOAD_JOB_RETRIES:
+                raise
+            delay = random.uniform(0, min(UPLOAD_RETRY_MAX_S, UPLOAD_RETRY_BASE_S * 2 ** attempt))
+            LOG.info("Upload of %s window %d failed (%r); retry %d in %.1f s",
+                     table, window_start, e, attempt + 1, delay)
+            time.sleep(delay)
+
+def catch_up(conn, end_ts: int) -> int:
+    """
+    Upload every pending window that ends at or before end_ts, oldest first,
+    with at most CATCHUP_CONCURRENCY uploads in flight and CATCHUP_MAX_WPS starts per second.
+    Mark-uploaded commits stay on this thread (serialized). Returns rows uploaded.
+    """
+    jobs = []
+    for table, prefix in UPLOAD_TABLES:
+        for window_start, n in pending_windows(conn, table, UPLOAD_PERIOD_S, end_ts):
+            jobs.append((window_start, table, prefix, n))
+    jobs.sort()
+
+    st = catchup_stats
+    st["backlog_objects"] = len(jobs)
+    st["backlog_windows"] = len({j[0] for j in jobs})
+    st["backlog_rows"] = sum(j[3] for j in jobs)
+    if not jobs:
+        st["eta_s"] = 0.0
+        return 0
+
+    rate = st["rate_wps"] or min(CATCHUP_MAX_WPS or float("inf"), float(max(1, CATCHUP_CONCURRENCY)))
+    st["eta_s"] = len(jobs) / rate
+    if st["backlog_windows"] > 1:
+        LOG.info("Upload backlog: %d windows (%d objects, %d rows), oldest %s, est. drain %.0f s",
+                 st["backlog_windows"], st["backlog_objects"], st["backlog_rows"],
+                 datetime.fromtimestamp(jobs[0][0], tz=timezone.utc).isoformat(), st["eta_s"])
+
+    t0 = time.monotonic()
+    deadline = t0 + CATCHUP_BUDGET_S
+    next_start = t0
+    todo = iter(jobs)
+    exhausted = False
+    in_flight = {}
+    done = 0
+    total_rows = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, CATCHUP_CONCURRENCY)) as ex:
+        while True:
+            while not exhausted and len(in_flight) < max(1, CATCHUP_CONCURRENCY) and time.monotonic() < deadline:
+                job = next(todo, None)
+                if job is None:
+                    exhausted = True
+                    break
+                # rate budget
+                now = time.monotonic()
+                if next_start > now:
+                    time.sleep(next_start - now)
+                next_start = max(now, next_start) + (1.0 / CATCHUP_MAX_WPS if CATCHUP_MAX_WPS > 0 else 0.0)
+                window_start, table, prefix, _n = job
+                in_flight[ex.submit(_upload_job, table, prefix, window_start)] = job
+
+            if not in_flight:
+                break
+
+            finished, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for fut in finished:
+                window_start, table, prefix, _n = in_flight.pop(fut)
+                try:
+                    rows, max_id, nbytes, key = fut.result()
+                except UPLOAD_ERRORS as e:
+                    st["failed_objects"] += 1
+                    LOG.warning("Upload of %s window %d failed (will retry next cycle): %r", table, window_start, e)
+                    continue
+                if rows:
+                    ack_window(conn, table, window_start, window_start + UPLOAD_PERIOD_S, max_id)
+                    conn.commit()
+                    LOG.info("Uploaded %d rows (%d bytes) from %s to s3://%s/%s", rows, nbytes, table, S3_BUCKET, key)
+                done += 1
+                total_rows += rows
+
+    elapsed = time.monotonic() - t0
+    st["uploaded_objects"] += done
+    if done and elapsed > 0:
+        measured = done / elapsed
+        st["rate_wps"] = measured if not st["rate_wps"] else 0.7 * st["rate_wps"] + 0.3 * measured
+    left = len(jobs) - done
+    st["eta_s"] = 0.0
+    if left:
+        st["eta_s"] = left / st["rate_wps"] if st["rate_wps"] else 0.0
+        LOG.info("Upload backlog: %d objects left after this cycle, est. drain %.0f s", left, st["eta_s"])
+    return total_rows
+
+def in_quiet_hours(spec: str, hour: int) -> bool:
+    # "1-5" -> 01:00 to 05:59, wraps past midnight ("22-3")
+    try:
+        a, b = (int(x) for x in spec.split("-"))
+    except ValueError:
+        return False
+    return a <= hour <= b if a <= b else (hour >= a or hour <= b)
 
 def main():
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s: %(message)s")
     init_db(DB_PATH)
+    next_maint = time.monotonic()
 
     while True:
         now = int(time.time())
         window_start = floor_window(now, UPLOAD_PERIOD_S)
 
-        # upload previous full window
-        target_start = window_start - UPLOAD_PERIOD_S
-        target_end   = window_start
-
         try:
-            with sqlite3.connect(DB_PATH, timeout=10) as conn:
+            with closing(sqlite3.connect(DB_PATH, timeout=10)) as conn:
                 conn.execute("PRAGMA journal_mode=WAL;")
                 conn.execute("PRAGMA synchronous=NORMAL;")
 
-                window_upload(conn, "sensor_samples", PFX_SENSORS, target_start, target_end)
-                window_upload(conn, "node_packets",   PFX_NODES,   target_start, target_end)
+                # previous full window plus anything left over from failed cycles / outages
+                catch_up(conn, window_start)
 
-        except (sqlite3.Error, BotoCoreError, ClientError, json.JSONDecodeError) as e:
+        except UPLOAD_ERRORS as e:
             LOG.warning("Upload error (will retry next cycle): %r", e)
 
+        if time.monotonic() >= next_maint:
+            next_maint = time.monotonic() + MAINT_PERIOD_S
+            try:
+                run_maintenance(
+                    DB_PATH,
+                    retention_s=int(DB_RETENTION_DAYS * 86400),
+                    quiet=in_quiet_hours(MAINT_QUIET_HOURS, datetime.now().hour),
+                    lock_budget_ms=MAINT_LOCK_BUDGET_MS,
+                    time_budget_s=UPLOAD_PERIOD_S * 0.2,
+                )
+            except sqlite3.Error as e:
+                LOG.warning("DB maintenance failed: %r", e)
+
         # sleep to next boundary
         now2 = time.time()
         next_tick = floor_window(int(now2), UPLOAD_PERIOD_S) + UPLOAD_PERIOD_S